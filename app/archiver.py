@@ -0,0 +1,100 @@
+import os
+import logging
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from db import SessionLocal, Event
+import changes
+import summary
+from dotenv import load_dotenv
+
+
+load_dotenv()
+os.makedirs(os.getenv("LOG_DIR"), exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(os.getenv("LOG_DIR"), "archiver.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+HORIZON = timedelta(hours=float(os.getenv("ARCHIVE_AFTER_HOURS", 24 * 7)))
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 300))
+COLUMNS = ", ".join(f'"{c.name}"' for c in Event.__table__.columns)
+
+# Cold rows: expired, deleted or finished longer than HORIZON ago. Pending tickets have a checkout in flight
+# and stay. SKIP LOCKED and a small batch per transaction keep row locks short and out of the writers' way.
+MOVE = text(f"""
+    WITH moved AS (
+        DELETE FROM events
+        WHERE id IN (
+            SELECT id FROM events
+            WHERE status IS DISTINCT FROM :pending
+              AND (
+                expire_at < :expired_before
+                OR (is_active = false AND updated_at < :updated_before)
+                OR (status IN (:scheduled, :failed) AND updated_at < :updated_before)
+              )
+            ORDER BY id
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING {COLUMNS}
+    )
+    INSERT INTO events_archive ({COLUMNS})
+    SELECT {COLUMNS} FROM moved
+    RETURNING id, event_id, is_active
+""")
+
+
+def archive_batch(db):
+    now = datetime.now()
+    rows = db.execute(MOVE, {
+        "pending": Event.STATUS_PENDING,
+        "scheduled": Event.STATUS_SCHEDULED,
+        "failed": Event.STATUS_FAILED,
+        "expired_before": now - HORIZON, # expire_at is local time, like the Discord timestamps
+        "updated_before": datetime.utcnow() - HORIZON,
+        "batch_size": BATCH_SIZE,
+    }).all()
+    if not rows:
+        db.rollback()
+        return 0
+
+    # status counts and totals keep including archived tickets, only the active count follows the hot table
+    deltas = {}
+    for row in rows:
+        if row.is_active:
+            summary.deactivated(row, deltas)
+    summary.apply(db, deltas)
+    db.execute(changes.notify([row.id for row in rows], changes.DELETED))
+    db.commit()
+    return len(rows)
+
+
+def run():
+    moved = 0
+    started = time.monotonic()
+    with SessionLocal() as db:
+        while True:
+            count = archive_batch(db)
+            moved += count
+            if count < BATCH_SIZE:
+                break
+    if moved:
+        logger.info(f"Archived {moved} events in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    try:
+        while True:
+            try:
+                run()
+            except Exception as e:
+                logger.error(e)
+            time.sleep(INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("Shutting down ...")
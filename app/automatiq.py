@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+try:
+    from . import outbound
+    from .cache import MISSING, TTLCache
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    import outbound
+    from cache import MISSING, TTLCache
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+LISTINGS_URL = os.getenv("AUTOMATIQ_LISTINGS_URL", "https://b2b.automatiq.com/api/ecomm/events/{}/listings")
+PAGE_SIZE = 100
+CACHE_TTL = float(os.getenv("AUTOMATIQ_CACHE_TTL", 10))
+CACHE_SIZE = int(os.getenv("AUTOMATIQ_CACHE_SIZE", 5000))
+RATE_LIMIT = float(os.getenv("AUTOMATIQ_RATE_LIMIT", 5)) # requests per second
+RATE_BURST = int(os.getenv("AUTOMATIQ_RATE_BURST", 5))
+# attempts per page of all_listings, the listener doesn't retry and leaves it to the next message
+RETRIES = int(os.getenv("AUTOMATIQ_RETRIES", 3))
+RETRY_BACKOFF = float(os.getenv("AUTOMATIQ_RETRY_BACKOFF", 0.5))
+
+# (automatiq_event_id, section) -> first page of listings
+listings_cache = TTLCache("automatiq_listings", CACHE_SIZE, CACHE_TTL)
+inflight = {}
+upstream = {
+    "calls": 0,
+    "errors": 0,
+    "coalesced": 0,
+    "latency_total": 0.0,
+    "latency_max": 0.0,
+}
+
+
+class RateLimiter:
+    """
+    Token bucket, callers wait for a token instead of getting rejected.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+limiter = RateLimiter(RATE_LIMIT, RATE_BURST)
+
+
+async def fetch_listings(automatiq_event_id, section, page=1):
+    await limiter.acquire()
+
+    started = time.monotonic()
+    upstream["calls"] += 1
+    try:
+        async with outbound.client("automatiq").get(
+            LISTINGS_URL.format(automatiq_event_id),
+            params={
+                "filter[section]": section,
+                "order_by_direction": "asc",
+                "page[size]": PAGE_SIZE,
+                "page[number]": page,
+            },
+            headers={
+                'accept': 'application/json',
+                'Authorization': f'Bearer {os.getenv("B2B_AUTOMATIQ_API_KEY")}',
+            }
+        ) as resp:
+            if resp.status != 200:
+                upstream["errors"] += 1
+                logger.error(f"Invalid response code {resp.status} from b2b.automatiq.com")
+                return None
+            return (await resp.json())["data"]
+    except Exception:
+        upstream["errors"] += 1
+        raise
+    finally:
+        latency = time.monotonic() - started
+        upstream["latency_total"] += latency
+        upstream["latency_max"] = max(upstream["latency_max"], latency)
+
+
+async def _load(key):
+    data = await fetch_listings(*key)
+    if data is not None: # errors are not cached, the next message retries
+        listings_cache.set(key, data)
+    return data
+
+
+async def listings(automatiq_event_id, section):
+    """
+    First page of listings for the section, served from the cache while fresh.
+    Concurrent misses for the same key share a single upstream call.
+    """
+    key = (automatiq_event_id, section)
+    data = listings_cache.get(key)
+    if data is not MISSING:
+        return data
+
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_load(key))
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    else:
+        upstream["coalesced"] += 1
+
+    return await asyncio.shield(task)
+
+
+async def fetch_page(automatiq_event_id, section, page):
+    """
+    fetch_listings with up to RETRIES attempts and exponential backoff, every attempt waits for the rate limiter.
+    """
+    for attempt in range(1, RETRIES + 1):
+        try:
+            listings = await fetch_listings(automatiq_event_id, section, page)
+        except Exception as e:
+            if attempt == RETRIES:
+                raise
+            logger.error(e)
+        else:
+            if listings is not None or attempt == RETRIES:
+                return listings
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+async def all_listings(automatiq_event_id, section, max_pages):
+    """
+    Every page of listings for the section (up to max_pages), None if a page failed on every attempt.
+    """
+    data = []
+    for page in range(1, max_pages + 1):
+        listings = await fetch_page(automatiq_event_id, section, page)
+        if listings is None:
+            return None
+        if page == 1: # fresher than whatever the listener has cached
+            listings_cache.set((automatiq_event_id, section), listings)
+        data += listings
+        if len(listings) < PAGE_SIZE:
+            break
+    return data
+
+
+def stats():
+    calls = upstream["calls"]
+    return {
+        "cache": listings_cache.stats(),
+        "upstream": {
+            **upstream,
+            "latency_avg": round(upstream["latency_total"] / calls, 4) if calls else None,
+        },
+    }
@@ -0,0 +1,28 @@
+import json
+from sqlalchemy import text
+
+
+CHANNEL = "events_changed"
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+CHUNK_SIZE = 500 # keep every payload well under the 8000 bytes NOTIFY limit
+
+
+def notify(ids, kind):
+    """
+    Statement that announces changed events rows to LISTEN-ers on CHANNEL.
+    Execute it in the same transaction as the write - Postgres delivers it on commit only.
+    It also bumps the shared events version and sends it along as "v". The row lock orders
+    the versions like the commits, so every web process sees them in the same increasing order.
+    """
+    ids = list(ids)
+    payloads = [
+        json.dumps({"kind": kind, "ids": ids[i:i + CHUNK_SIZE]})
+        for i in range(0, len(ids), CHUNK_SIZE)
+    ]
+    return text(
+        "WITH v AS (UPDATE events_version SET version = version + 1 WHERE id = 1 RETURNING version) "
+        "SELECT pg_notify(:channel, (payload::jsonb || jsonb_build_object('v', v.version))::text) "
+        "FROM unnest(CAST(:payloads AS text[])) AS payload, v"
+    ).bindparams(channel=CHANNEL, payloads=payloads)
@@ -0,0 +1,139 @@
+import json
+import sys
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from db import engine
+import checkout
+import inbox
+import lookups
+import queries
+import rules
+
+
+# Hot queries of main.py, discord_listener.py and checkout_worker.py and the index (or indexes) each one must use,
+# built by the same functions those modules call so the checks can't drift from the real statements.
+# Sequential scans are disabled, so a check only fails if the index is missing or can't serve the query.
+NO_FILTERS = queries.NO_FILTERS
+CHECKS = [
+    (
+        "/items/ and /tickets, any event",
+        queries.tickets(1, "Any")[0],
+        "ix_events_active_id",
+    ),
+    (
+        "/items/ and /tickets, one event",
+        queries.tickets(1, "1")[0],
+        "ix_events_active_event_id_id",
+    ),
+    (
+        "/items/ and /tickets, next page cursor",
+        queries.tickets(2, "1", NO_FILTERS, after_id=1000)[0],
+        "ix_events_active_event_id_id",
+    ),
+    (
+        "/items/ and /tickets, sorted by ROI",
+        queries.tickets(1, "Any", {**NO_FILTERS, "sort": "roi"})[0],
+        "ix_events_active_roi_id",
+    ),
+    (
+        "/items/ and /tickets, unexpired sorted by expiry",
+        queries.tickets(1, "Any", {**NO_FILTERS, "sort": "expire", "unexpired": True})[0],
+        "ix_events_active_expire_ts_id",
+    ),
+    (
+        "/items/ and /tickets, section and row filter",
+        queries.tickets(1, "Any", {**NO_FILTERS, "section": "100x", "max_row": 10})[0],
+        "ix_events_active_section_bucket_row_num",
+    ),
+    (
+        "/deals top tickets",
+        queries.deals(20),
+        "ix_events_deals",
+    ),
+    (
+        "/deals top tickets, one event",
+        queries.deals(20, "1"),
+        "ix_events_deals_event_id",
+    ),
+    (
+        "/deals best tickets per event",
+        queries.deals(20, per_event=3),
+        "ix_events_deals_event_id",
+    ),
+    (
+        "/events dashboard page",
+        queries.events(1),
+        "event_summaries_pkey",
+    ),
+    (
+        "event_details lookup",
+        lookups.event_details_query(["1", "2"]),
+        "ix_event_details_event_id",
+    ),
+    (
+        "bot_accounts lookup",
+        lookups.bot_accounts_query(["a@b.c"]),
+        "ix_bot_accounts_email",
+    ),
+    (
+        "auto approval rules reload",
+        rules.query(),
+        "ix_auto_aproval_rules_event_id_section",
+    ),
+    (
+        "listener message dedup",
+        queries.stored_message_ids(["1", "2"]),
+        ("ix_events_message_id", "ix_events_archive_message_id"),
+    ),
+    (
+        "listener resume point",
+        queries.last_posted_at(),
+        ("ix_events_posted_at", "ix_events_archive_posted_at"),
+    ),
+    (
+        "checkout job claim",
+        checkout.claim(datetime.utcnow()),
+        "ix_checkout_jobs_open",
+    ),
+    (
+        "stale checkout jobs",
+        checkout.give_up(datetime.utcnow()),
+        "ix_checkout_jobs_open",
+    ),
+    (
+        "sharded listener inbox claim",
+        inbox.claim(),
+        "listener_inbox_pkey",
+    ),
+]
+
+
+def index_names(plan):
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= index_names(child)
+    return names
+
+
+def check():
+    failed = 0
+    with engine.connect() as conn:
+        conn.execute(text("SET enable_seqscan = off"))
+        for name, query, index in CHECKS:
+            sql = str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+            used = index_names(plan)
+            ok = set(index if isinstance(index, tuple) else [index]) <= used
+            failed += 0 if ok else 1
+            print(f"[{'OK' if ok else 'FAIL'}] {name}: expected {index}, plan uses {sorted(used) or 'no index'}")
+        conn.rollback()
+
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if check() else 0)
@@ -0,0 +1,96 @@
+import os
+from datetime import datetime as dt, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+try:
+    from .db import CheckoutJob
+except ImportError: # imported from the listener/worker, which run with app/ on sys.path
+    from db import CheckoutJob
+
+
+load_dotenv()
+CHANNEL = "checkout_jobs"
+MAX_ATTEMPTS = int(os.getenv("CHECKOUT_MAX_ATTEMPTS", 3))
+TIMEOUT = float(os.getenv("CHECKOUT_TIMEOUT", 10))
+BACKOFF = float(os.getenv("CHECKOUT_BACKOFF", 2))
+# a running job not finished for this long has a dead or stuck worker
+STALE_AFTER = timedelta(seconds=TIMEOUT * 3)
+MAY_HAVE_GONE_THROUGH = "the checkout may have gone through, check the bot before buying again"
+
+
+def enqueue(event_ids):
+    """
+    Queue a checkout per event id and return (id, event_id) of the queued jobs.
+    Idempotent per event id: a job that is queued, running or done is left alone (and not returned),
+    a failed one is queued again.
+    """
+    now = dt.utcnow()
+    stmt = insert(CheckoutJob).values([
+        {
+            "event_id": event_id,
+            "status": CheckoutJob.STATUS_QUEUED,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for event_id in event_ids
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[CheckoutJob.event_id],
+        set_={
+            "status": CheckoutJob.STATUS_QUEUED,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "last_error": None,
+            "updated_at": now,
+        },
+        where=CheckoutJob.status == CheckoutJob.STATUS_FAILED,
+    ).returning(CheckoutJob.id, CheckoutJob.event_id)
+
+
+def claim(now):
+    """
+    Take the oldest due job and mark it running, returns (id, event_id, attempts).
+    """
+    job_id = select(CheckoutJob.id) \
+        .where(CheckoutJob.status == CheckoutJob.STATUS_QUEUED, CheckoutJob.next_attempt_at <= now) \
+        .order_by(CheckoutJob.id) \
+        .limit(1) \
+        .with_for_update(skip_locked=True) \
+        .correlate(None) \
+        .scalar_subquery()
+
+    return update(CheckoutJob) \
+        .where(CheckoutJob.id == job_id) \
+        .values(status=CheckoutJob.STATUS_RUNNING, attempts=CheckoutJob.attempts + 1, updated_at=now) \
+        .returning(CheckoutJob.id, CheckoutJob.event_id, CheckoutJob.attempts)
+
+
+def give_up(now):
+    """
+    Fail the jobs running for longer than STALE_AFTER, returns (id, event_id) of them.
+    The bot may have taken their request already, so they are never posted again.
+    """
+    return update(CheckoutJob) \
+        .where(CheckoutJob.status == CheckoutJob.STATUS_RUNNING, CheckoutJob.updated_at < now - STALE_AFTER) \
+        .values(status=CheckoutJob.STATUS_FAILED, last_error=f"Stale running job ({MAY_HAVE_GONE_THROUGH})", updated_at=now) \
+        .returning(CheckoutJob.id, CheckoutJob.event_id)
+
+
+def wake():
+    """
+    Statement that wakes idle checkout workers once the enqueueing transaction commits.
+    """
+    return select(func.pg_notify(CHANNEL, ""))
+
+
+def job_dict(job):
+    return {
+        "id": job.id,
+        "event_id": job.event_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+    }
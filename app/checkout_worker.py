@@ -0,0 +1,210 @@
+import os
+import logging
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+import psycopg2
+import requests
+from prometheus_client import Counter, Histogram, start_http_server
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from sqlalchemy import update
+from db import DATABASE_URL, SessionLocal, Event, CheckoutJob, engine
+import changes
+import checkout
+import metrics
+import outbound
+import summary
+from dotenv import load_dotenv
+
+
+load_dotenv()
+os.makedirs(os.getenv("LOG_DIR"), exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(os.getenv("LOG_DIR"), "checkout_worker.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+WORKERS = int(os.getenv("CHECKOUT_WORKERS", 4))
+POLL_INTERVAL = float(os.getenv("CHECKOUT_POLL_INTERVAL", 1))
+STATS_INTERVAL = 60
+wake = threading.Event()
+
+METRICS_PORT = int(os.getenv("CHECKOUT_WORKER_METRICS_PORT", 9102))
+DISPATCH_SECONDS = Histogram("checkout_dispatch_seconds", "Checkout bot call latency", ["result"])
+DROP_TO_DISPATCH_SECONDS = Histogram(
+    "checkout_drop_to_dispatch_seconds",
+    "Discord post to checkout bot accepting the ticket",
+    buckets=(0.5, 1, 2, 3, 5, 7.5, 10, 15, 30, 60),
+)
+JOBS = Counter("checkout_jobs_total", "Finished checkout attempts", ["status"])
+# the bot answered that it can't take requests right now, nothing was bought
+RETRY_STATUSES = {502, 503}
+
+
+def claim(db):
+    job = db.execute(checkout.claim(datetime.utcnow())).first()
+    db.commit()
+    return job
+
+
+def give_up(db):
+    jobs = db.execute(checkout.give_up(datetime.utcnow())).all()
+    for job in jobs:
+        logger.error(f"Checkout job {job.id} of event.id={job.event_id} went stale, failed ({checkout.MAY_HAVE_GONE_THROUGH})")
+        set_event_status(db, job.event_id, Event.STATUS_FAILED)
+    db.commit()
+    if jobs:
+        JOBS.labels(CheckoutJob.STATUS_FAILED).inc(len(jobs))
+
+
+def set_event_status(db, event_id, status):
+    event = db.query(Event) \
+        .filter(Event.id == event_id, Event.status == Event.STATUS_PENDING) \
+        .with_for_update() \
+        .first()
+    if not event:
+        return
+
+    old_status = event.status
+    event.status = status
+    db.add(event)
+    summary.apply(db, summary.status_changed(event, old_status))
+    db.execute(changes.notify([event.id], changes.UPDATED))
+
+
+def finish(db, job, status, error=None, event_status=None):
+    values = {"status": status, "last_error": error, "updated_at": datetime.utcnow()}
+    if status == CheckoutJob.STATUS_QUEUED:
+        # exponential backoff: BACKOFF, 2 * BACKOFF, 4 * BACKOFF ...
+        values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=checkout.BACKOFF * 2 ** (job.attempts - 1))
+
+    # only while this claim still owns the job, a stale one was failed by give_up meanwhile
+    updated = db.execute(
+        update(CheckoutJob)
+        .where(CheckoutJob.id == job.id, CheckoutJob.status == CheckoutJob.STATUS_RUNNING, CheckoutJob.attempts == job.attempts)
+        .values(**values)
+    ).rowcount
+    if not updated:
+        db.rollback()
+        logger.error(f"Checkout job {job.id} of event.id={job.event_id} was given up on before it finished, dropped result: {status} {error or ''}")
+        return
+    if event_status:
+        set_event_status(db, job.event_id, event_status)
+    db.commit()
+    JOBS.labels(status).inc()
+
+
+def never_reached(e):
+    """
+    True if the request failed before the bot could see it, so posting it again can't buy the ticket twice.
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError):
+        reason = getattr(e.args[0], "reason", None) if e.args else None # urllib3 MaxRetryError
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+def dispatch(db, job):
+    event = db.query(Event).filter(Event.id == job.event_id).first()
+    if not event or not event.encsoft_url or not event.cvv:
+        finish(db, job, CheckoutJob.STATUS_FAILED, "Event checkout url or CVV is empty", Event.STATUS_FAILED)
+        return
+
+    error = None
+    retry = False
+    started = time.monotonic()
+    try:
+        resp = outbound.request(
+            "checkout",
+            "POST",
+            os.getenv("CHECKOUT_BOT_API_URL"),
+            json={
+                "encsoft_url": event.encsoft_url,
+                "cvv": event.cvv,
+            },
+            headers={"Idempotency-Key": f"checkout-{event.id}"}, # for a bot that dedupes, we don't rely on it
+        )
+        if resp.status_code == 200:
+            DISPATCH_SECONDS.labels("ok").observe(time.monotonic() - started)
+            if event.posted_at: # tickets from the Discord listener
+                DROP_TO_DISPATCH_SECONDS.observe((datetime.now() - event.posted_at).total_seconds())
+            finish(db, job, CheckoutJob.STATUS_DONE, event_status=Event.STATUS_SCHEDULED)
+            return
+        error = f"Invalid response code {resp.status_code} from checkout bot"
+        retry = resp.status_code in RETRY_STATUSES
+    except Exception as e:
+        error = str(e)
+        retry = never_reached(e)
+        if not retry:
+            # e.g. a read timeout, the bot may have bought the ticket already
+            error = f"{error} ({checkout.MAY_HAVE_GONE_THROUGH})"
+    DISPATCH_SECONDS.labels("error").observe(time.monotonic() - started)
+
+    logger.error(f"Checkout failed. event.id={job.event_id} attempt={job.attempts}: {error}")
+    # only retried when the checkout surely didn't happen, anything else is left to the operators
+    if retry and job.attempts < checkout.MAX_ATTEMPTS:
+        finish(db, job, CheckoutJob.STATUS_QUEUED, error)
+    else:
+        finish(db, job, CheckoutJob.STATUS_FAILED, error, Event.STATUS_FAILED)
+
+
+def work():
+    while True:
+        job = None
+        try:
+            with SessionLocal() as db:
+                give_up(db)
+                job = claim(db)
+                if job:
+                    dispatch(db, job)
+        except Exception as e:
+            logger.error(e)
+
+        if not job:
+            wake.wait(POLL_INTERVAL)
+            wake.clear()
+
+
+def listen():
+    stats_at = time.monotonic()
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute(f"LISTEN {checkout.CHANNEL}")
+            while True:
+                if select.select([conn], [], [], 5)[0]:
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        wake.set()
+                if time.monotonic() - stats_at >= STATS_INTERVAL:
+                    logger.info(f"Outbound stats: {outbound.stats()}")
+                    stats_at = time.monotonic()
+        except Exception as e:
+            logger.error(e)
+            time.sleep(3)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+if __name__ == "__main__":
+    metrics.instrument_engine(engine, "sync")
+    metrics.register_stats(outbound=outbound.stats)
+    start_http_server(METRICS_PORT)
+    for i in range(WORKERS):
+        threading.Thread(target=work, name=f"checkout-worker-{i}", daemon=True).start()
+    try:
+        listen()
+    except KeyboardInterrupt:
+        logger.info("Shutting down ...")
@@ -2,14 +2,23 @@
 import os
 from datetime import datetime as dt
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Float
+from sqlalchemy import create_engine, Column, Index, Integer, BigInteger, String, DateTime, Boolean, Float
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 
 load_dotenv()
 DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autocommit=False, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -18,15 +27,21 @@ class Event(Base):
     __tablename__ = "events"
 
     STATUS_NEW = "new"
+    STATUS_PENDING = "pending" # claimed for checkout, waiting for the checkout bot
     STATUS_SCHEDULED = "scheduled"
     STATUS_FAILED = "failed"
 
     id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(String, unique=True, index=True) # Discord message the ticket came from
+    posted_at = Column(DateTime, index=True)
     event_id = Column(String)
     event_name = Column(String)
     bot_email = Column(String)
     section = Column(String)
     row = Column(String)
+    # normalized once at ingest (normalize.py) so pages can filter and sort on them in SQL
+    section_bucket = Column(String) # "100x".."500x" for numbered sections, the section itself otherwise
+    row_num = Column(Integer) # A..Z, AA..ZZ mapped to 1..52
     price = Column(Float)
     amount = Column(Integer)
     full_price = Column(Float)
@@ -34,6 +49,7 @@ class Event(Base):
     listing_low_price = Column(Float)
     roi = Column(Float)
     expire_at = Column(DateTime)
+    expire_ts = Column(BigInteger) # expire_at in epoch seconds
     encsoft_url = Column(String)
     cvv = Column(String)
     status = Column(String)
@@ -41,17 +57,70 @@ class Event(Base):
     created_at = Column(DateTime, default=dt.utcnow)
     updated_at = Column(DateTime, default=dt.utcnow, onupdate=dt.utcnow)
 
+    __table_args__ = (
+        # /items/ and /tickets pages, all events and filtered by event
+        Index("ix_events_active_id", "id", postgresql_where=(is_active == True)),
+        Index("ix_events_active_event_id_id", "event_id", "id", postgresql_where=(is_active == True)),
+        # their filters and sort orders
+        Index("ix_events_active_roi_id", roi.desc().nullslast(), "id", postgresql_where=(is_active == True)),
+        Index("ix_events_active_expire_ts_id", "expire_ts", "id", postgresql_where=(is_active == True)),
+        Index("ix_events_active_section_bucket_row_num", "section_bucket", "row_num", postgresql_where=(is_active == True)),
+        # /deals, best ROI first among the tickets that can still be bought
+        Index(
+            "ix_events_deals", roi.desc(), "expire_ts", "id",
+            postgresql_where=(is_active == True) & (status == STATUS_NEW) & roi.isnot(None),
+        ),
+        Index(
+            "ix_events_deals_event_id", "event_id", roi.desc(), "expire_ts", "id",
+            postgresql_where=(is_active == True) & (status == STATUS_NEW) & roi.isnot(None),
+        ),
+    )
+
+class EventSummary(Base):
+    __tablename__ = "event_summaries"
+    event_id = Column(String, primary_key=True)
+    full_price_total = Column(Float, default=0, nullable=False) # scheduled tickets only
+    new_count = Column(Integer, default=0, nullable=False)
+    pending_count = Column(Integer, default=0, nullable=False)
+    scheduled_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    active_count = Column(Integer, default=0, nullable=False)
+    total_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=dt.utcnow, onupdate=dt.utcnow)
+
+class CheckoutJob(Base):
+    __tablename__ = "checkout_jobs"
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, unique=True, index=True, nullable=False) # one checkout per ticket
+    status = Column(String, default=STATUS_QUEUED, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=dt.utcnow, nullable=False)
+    last_error = Column(String)
+    created_at = Column(DateTime, default=dt.utcnow)
+    updated_at = Column(DateTime, default=dt.utcnow, onupdate=dt.utcnow)
+
+    __table_args__ = (
+        # jobs the checkout workers still have to claim
+        Index("ix_checkout_jobs_open", "id", postgresql_where=status.in_([STATUS_QUEUED, STATUS_RUNNING])),
+    )
+
 class EventDetails(Base):
     __tablename__ = "event_details"
     id = Column(Integer, primary_key=True, index=True)
     event_name = Column(String)
-    event_id = Column(String)
+    event_id = Column(String, unique=True, index=True)
     automatiq_event_id = Column(String)
 
 class BotAccount(Base):
     __tablename__ = "bot_accounts"
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String)
+    email = Column(String, unique=True, index=True)
     cvv = Column(String)
 
 class AutoAprovalRules(Base):
@@ -62,6 +131,31 @@ class AutoAprovalRules(Base):
     section = Column(String)
     row = Column(Integer)
 
+    __table_args__ = (
+        Index("ix_auto_aproval_rules_event_id_section", "event_id", "section", "row"),
+    )
+
+class ListenerState(Base):
+    __tablename__ = "listener_state"
+    name = Column(String, primary_key=True)
+    value = Column(String)
+    updated_at = Column(DateTime, default=dt.utcnow, onupdate=dt.utcnow)
+
+class EventsVersion(Base):
+    __tablename__ = "events_version"
+    # single row, bumped by changes.notify in every transaction that changes events, the /items/ ETag
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+
+class ListenerInbox(Base):
+    __tablename__ = "listener_inbox"
+    # relay messages waiting for a listener worker, see LISTENER_MODE=sharded
+    id = Column(Integer, primary_key=True)
+    message_id = Column(String, unique=True, nullable=False)
+    posted_at = Column(BigInteger, nullable=False) # epoch seconds, as the relay sends it
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, default=dt.utcnow)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -69,5 +163,7 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-Base.metadata.create_all(bind=engine)
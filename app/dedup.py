@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+
+class RecentIds:
+    """
+    Message ids seen during the last `window` seconds of message time, capped at `maxsize`.
+    Anything older than the window is the DB unique index's job, so memory stays flat.
+    """
+
+    def __init__(self, window, maxsize):
+        self.window = window
+        self.maxsize = maxsize
+        self.ids = OrderedDict() # message id -> posted_at (unix seconds), oldest first
+        self.newest = 0
+
+    def cutoff(self):
+        return self.newest - self.window
+
+    def add(self, id, posted_at):
+        if id in self.ids:
+            return False
+
+        self.ids[id] = posted_at
+        self.newest = max(self.newest, posted_at)
+        while self.ids and (len(self.ids) > self.maxsize or next(iter(self.ids.values())) < self.cutoff()):
+            self.ids.popitem(last=False)
+        return True
+
+    def forget(self, ids):
+        """
+        Unmark ids that weren't handled after all, so they are taken again when refetched.
+        """
+        for id in ids:
+            self.ids.pop(id, None)
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
@@ -1,10 +1,25 @@
-import requests
+import asyncio
 import os
-import time
 import logging
-import re
+import time
 from datetime import datetime
-from db import SessionLocal, Event, EventDetails, BotAccount, AutoAprovalRules
+from prometheus_client import Counter, Histogram, start_http_server
+from sqlalchemy import exc, text, update
+from sqlalchemy.dialects.postgresql import insert
+from db import AsyncSessionLocal, Event, ListenerState, async_engine
+from dedup import RecentIds
+from normalize import row_number, section_bucket
+import pricing
+import changes
+import summary
+import lookups
+import automatiq
+import rules
+import checkout
+import outbound
+import metrics
+import inbox
+import queries
 from dotenv import load_dotenv
 
 
@@ -19,287 +34,556 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
-db = SessionLocal()
-ids = set()
+ids = RecentIds(
+    window=int(os.getenv("LISTENER_DEDUP_WINDOW", 3600)),
+    maxsize=int(os.getenv("LISTENER_DEDUP_SIZE", 100000)),
+)
 start_time = datetime.now()
-EVENT_ROWS_MAPPER = {
-    "A": 1, 
-    "B": 2, 
-    "C": 3, 
-    "D": 4, 
-    "E": 5, 
-    "F": 6, 
-    "G": 7, 
-    "H": 8, 
-    "I": 9, 
-    "J": 10,
-    "K": 11, 
-    "L": 12, 
-    "M": 13, 
-    "N": 14, 
-    "O": 15, 
-    "P": 16, 
-    "Q": 17, 
-    "R": 18, 
-    "S": 19,
-    "T": 20, 
-    "U": 21, 
-    "V": 22, 
-    "W": 23, 
-    "X": 24, 
-    "Y": 25, 
-    "Z": 26, 
-    "AA": 27, 
-    "BB": 28,
-    "CC": 29, 
-    "DD": 30, 
-    "EE": 31, 
-    "FF": 32, 
-    "GG": 33, 
-    "HH": 34,
-    "II": 35, 
-    "JJ": 36,
-    "KK": 37, 
-    "LL": 38, 
-    "MM": 39, 
-    "NN": 40, 
-    "OO": 41, 
-    "PP": 42, 
-    "QQ": 43, 
-    "RR": 44,
-    "SS": 45, 
-    "TT": 46, 
-    "UU": 47, 
-    "VV": 48, 
-    "WW": 49, 
-    "XX": 50, 
-    "YY": 51, 
-    "ZZ": 52
-}
-
-def range_to_x(num):
-    if 100 <= num <= 599:
-        return f"{(num // 100) * 100}x"
-    return None
+STATS_INTERVAL = 60
+CONCURRENCY = int(os.getenv("LISTENER_CONCURRENCY", 10))
+semaphore = asyncio.Semaphore(CONCURRENCY)
+enrichments = set() # running enrich_stored tasks, kept referenced until done
+# polls right away again while messages keep coming, doubling the pause up to POLL_MAX when idle
+POLL_MIN = float(os.getenv("LISTENER_POLL_MIN", 0.5))
+POLL_MAX = float(os.getenv("LISTENER_POLL_MAX", 3))
+# the relay only returns messages posted at or after ?since=<epoch seconds>, the overlap covers
+# messages sharing a second with the cursor, the dedup drops them
+SINCE_PARAM = os.getenv("DISCORD_SINCE_PARAM", "since")
+SINCE_OVERLAP = 5
+relay = {"since": None, "etag": None}
+# single: this process polls and ingests everything, only one may run
+# sharded: any number of processes, the leader polls into listener_inbox and all of them ingest from it
+SHARDED = os.getenv("LISTENER_MODE", "single") == "sharded"
 
+METRICS_PORT = int(os.getenv("LISTENER_METRICS_PORT", 9101))
+CYCLE_SECONDS = Histogram("listener_cycle_seconds", "Poll cycle duration")
+CYCLE_MESSAGES = Histogram(
+    "listener_cycle_messages",
+    "New messages per poll cycle",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+MESSAGES = Counter("listener_messages_total", "Relay messages by outcome", ["outcome"])
+ENRICH_SECONDS = Histogram("listener_enrich_seconds", "Automatiq enrichment latency per ticket")
+APPROVALS = Counter("listener_approvals_total", "Auto-approval outcomes", ["outcome"])
+# time from the Discord drop to the checkout job being committed
+DROP_TO_CHECKOUT_SECONDS = Histogram(
+    "listener_drop_to_checkout_seconds",
+    "Discord post to checkout job enqueued",
+    buckets=(0.5, 1, 2, 3, 5, 7.5, 10, 15, 30, 60),
+)
 
-def is_high_quality_ticket(event):
-    section = event.section if event.section else None
-    if section and section.isdigit():
-        section = int(section)
-        section = range_to_x(section)
-
-    row = event.row.strip() if event.row else None
-    if row and not re.match(r'[0-9]+', row):
-        row = EVENT_ROWS_MAPPER.get(row)
-    try:
-        row = int(row)
-    except:
-        row = None
 
-    if not section or not row:
-        return False
-    
-    rule = db.query(AutoAprovalRules).filter(
-        AutoAprovalRules.event_id==event.event_id,
-        AutoAprovalRules.row>=row,
-        AutoAprovalRules.section==str(section)
-    ).first()
-
-    return True if rule else False
+def is_high_quality_ticket(event):
+    return rules.is_approved(event.event_id, event.section_bucket, event.row_num)
 
 
-def schedule_to_buy(event):
+def can_checkout(event):
     if not event.encsoft_url or not event.cvv:
         logger.error("Empty encsoft_url or cvv")
         return False
-    
-    try:
-        resp = requests.post(
-            url=os.getenv("CHECKOUT_BOT_API_URL"),
-            json={
-                "encsoft_url": event.encsoft_url,
-                "cvv": event.cvv,
-            }
-        )
+    return True
 
-        if resp.status_code == 200:
-            return True
-    except Exception as e:
-        logger.error(e)
-
-    return False
 
-
-def enrich_event(event):
-    event_row = event.row
-    if not event_row.isdigit():
-        event_row = EVENT_ROWS_MAPPER.get(event_row)
-        if not event_row:
-            return
-    
-    event_row = int(event_row)
+async def enrich_event(event, automatiq_event_id):
+    event_row = event.row_num
+    if not event_row:
+        return
 
     if not event.event_id or not event.section or not event_row:
         logger.error(f"Invalid event_id or section or row. event.id={event.id}")
         return
     
-    event_details = db.query(EventDetails).filter(EventDetails.event_id == event.event_id).first()
-    if not event_details or not event_details.automatiq_event_id:
+    if not automatiq_event_id:
         logger.error(f"automatiq_event_id not found. event_id={event.event_id}")
         return
     
-    resp = requests.get(
-        f"https://b2b.automatiq.com/api/ecomm/events/{event_details.automatiq_event_id}/listings?filter[section]={event.section}&order_by_direction=asc&page[size]=100&page[number]=1", 
-        headers={
-            'accept': 'application/json',
-            'Authorization': f'Bearer {os.getenv("B2B_AUTOMATIQ_API_KEY")}',
-        }
-    )
-    if resp.status_code != 200:
-        logger.error(f"Invalid response code {resp.status_code} from b2b.automatiq.com")
+    listings = await automatiq.listings(automatiq_event_id, event.section)
+    if listings is None:
         return
-    
-    lowest_price = None
-    for listing in resp.json()["data"]:
-        listing = listing.get("attributes")
-        if not listing:
-            continue
-
-        price = listing.get("price")
-        section = listing.get("section")
-        row = listing.get("row")
-        if not price or not section or not row:
-            continue
-
-        price = price / 100
-        
-        if not row.isdigit():
-            row = EVENT_ROWS_MAPPER.get(row)
-            if not row:
-                continue
-        
-        row = int(row)
-
-        if row and row <= event_row + 3: # check rows in diapason from 1 to currennt row + 3
-            if not lowest_price:
-                lowest_price = price
-            elif price < lowest_price:
-                lowest_price = price
 
+    # first page only, to keep ingest fast, repricer.py refreshes it from all pages later
+    lowest_price = pricing.lowest_prices(pricing.listing_prices(listings), [event_row])[0]
     if not lowest_price:
         return
     
-    # calculate roi
-    roi = round(((lowest_price / event.price_plus_fees * 0.9) - 1) * 100, 2) if event.price_plus_fees else 0
-    
     # enrich event
     event.listing_low_price = lowest_price
-    event.roi = roi
+    event.roi = pricing.roi(lowest_price, event.price_plus_fees)
 
 
-def run():
+def parse_message(msg):
+    data = dict()
+    for row in msg["embeds"][0]["fields"]:
+        name = row.get("name")
+        val = row.get("value")
+        if name and val:
+            data[name] = val
+
+    # validate
+    required = {"Event ID", "Account", "Section", "Row", "Price", "Full price", "Amount", "Expiration", "Full checkout"}
+    for k in required:
+        if not data.get(k):
+            raise ValueError(f"Field {k} is required")
+
+    return data
+
+
+def build_event(message_id, posted_at, data, event_details, cvvs):
+    event_name = event_details.get(data["Event ID"])
+    event_name = event_name[0] if event_name else None
+    full_price = round(float(data["Full price"]), 2)
+    amount = int(data["Amount"])
+    if not full_price or not amount:
+        raise ValueError("Invalid full price or amount")
+    
+    price_plus_fees = round(full_price / amount, 2)
+    expire_ts = int(data["Expiration"].replace("<t:", "").replace(":R>", ""))
+
+    return Event(
+        message_id=message_id,
+        posted_at=datetime.fromtimestamp(posted_at),
+        event_id=data["Event ID"],
+        event_name=event_name,
+        bot_email=data["Account"],
+        section=data["Section"],
+        section_bucket=section_bucket(data["Section"]),
+        row=data["Row"],
+        row_num=row_number(data["Row"]),
+        price=float(data["Price"]),
+        amount=int(data["Amount"]),
+        full_price=float(data["Full price"]),
+        price_plus_fees=price_plus_fees,
+        expire_at=datetime.fromtimestamp(expire_ts),
+        expire_ts=expire_ts,
+        encsoft_url=data["Full checkout"],
+        cvv=cvvs.get(data["Account"]),
+        status=Event.STATUS_NEW,
+        is_active=True
+    )
+
+
+def approve(event):
+    """
+    Tell whether the event is auto-approved for checkout. Only the rules decide, not the
+    Automatiq prices, so approved tickets are queued without waiting for enrichment.
+    """
     try:
-        response = requests.get(os.getenv('DISCORD_SERVER_SIDE_URL'))
-
-        if response.status_code == 200:
-            messages = response.json()
-            for msg in messages:
-                try:
-                    id = msg.get("messageId")
-                    try:
-                        posted_at = int(msg.get("timestamp"))
-                    except:
-                        posted_at = None
-
-                    if not id or not posted_at or posted_at < start_time.timestamp():
-                        continue
-
-                    if id in ids:
-                        continue
-
-                    ids.add(id)
-
-                    # prepare data
-                    data = dict()
-                    try:
-                        for row in msg["embeds"][0]["fields"]:
-                            name = row.get("name")
-                            val = row.get("value")
-                            if name and val:
-                                data[name] = val
-                    except Exception as e:
-                        logger.error(e)
-                        return
-                    
-                    # validate
-                    required = {"Event ID", "Account", "Section", "Row", "Price", "Full price", "Amount", "Expiration", "Full checkout"}
-                    for k in required:
-                        if not data.get(k):
-                            logger.error(f"Field {k} is required")
-                            return
-
-                    # enrich
-                    event_details = db.query(EventDetails).filter(EventDetails.event_id == data["Event ID"]).first()
-                    event_name = event_details.event_name if event_details else None
-                    bot = db.query(BotAccount).filter(BotAccount.email == data["Account"]).first()
-                    cvv = bot.cvv if bot else None
-                    full_price = round(float(data["Full price"]), 2)
-                    amount = int(data["Amount"])
-                    if not full_price or not amount:
-                        logger.error("Invalid full price or amount")
-                        return
-                    
-                    price_plus_fees = round(full_price / amount, 2)
-                    expire_at = None
-                    try:
-                        expire_at = datetime.fromtimestamp(int(data["Expiration"].replace("<t:", "").replace(":R>", "")))
-                    except Exception as e:
-                        logger.error(e)
-                        return
-
-                    event = Event(
-                        event_id=data["Event ID"],
-                        event_name=event_name,
-                        bot_email=data["Account"],
-                        section=data["Section"],
-                        row=data["Row"],
-                        price=float(data["Price"]),
-                        amount=int(data["Amount"]),
-                        full_price=float(data["Full price"]),
-                        price_plus_fees=price_plus_fees,
-                        expire_at=expire_at,
-                        encsoft_url=data["Full checkout"],
-                        cvv=cvv,
-                        status=Event.STATUS_NEW
-                    )
-
-                    try:
-                        enrich_event(event)
-                    except Exception as e:
-                        logger.error(e)
-
-                    # Auto aproval stuff
-                    if is_high_quality_ticket(event):
-                        if schedule_to_buy(event):
-                            event.status = Event.STATUS_SCHEDULED
-                        else:
-                            event.status = Event.STATUS_FAILED
-
-                    db.add(event)
-                    db.commit()
-                    db.refresh(event)
-                except Exception as e:
-                    logger.error(e)
+        # Auto aproval stuff
+        if is_high_quality_ticket(event):
+            if can_checkout(event):
+                event.status = Event.STATUS_PENDING
+                APPROVALS.labels("approved").inc()
+                return True
+            event.status = Event.STATUS_FAILED
+            APPROVALS.labels("failed").inc()
         else:
-            logger.error("Error:", response.status_code, response.text)
+            APPROVALS.labels("manual").inc()
     except Exception as e:
+        APPROVALS.labels("error").inc()
         logger.error(e)
-        
-try:
+
+    return False
+
+
+async def process_event(event, event_details):
+    async with semaphore:
+        try:
+            details = event_details.get(event.event_id)
+            with ENRICH_SECONDS.time():
+                await enrich_event(event, details[1] if details else None)
+        except Exception as e:
+            logger.error(e)
+
+
+async def enrich_stored(events, stored, event_details):
+    """
+    Enrich tickets that are already stored (and queued for checkout if approved), then update their prices.
+    """
+    await asyncio.gather(*(process_event(event, event_details) for event in events))
+    now = datetime.utcnow()
+    rows = [
+        {"id": stored[e.message_id], "listing_low_price": e.listing_low_price, "roi": e.roi, "updated_at": now}
+        for e in events
+        if e.listing_low_price is not None
+    ]
+    if not rows:
+        return
+
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Event), rows)
+            await db.execute(changes.notify([row["id"] for row in rows], changes.UPDATED))
+            await db.commit()
+    except Exception as e:
+        logger.error(e) # the repricer fills the prices in on its next run
+
+
+def event_row(event):
+    now = datetime.utcnow()
+    row = {c.key: getattr(event, c.key) for c in Event.__table__.columns if c.key != "id"}
+    row["created_at"] = row["created_at"] or now
+    row["updated_at"] = row["updated_at"] or now
+    return row
+
+
+async def save(db, events, approved):
+    inserted = (await db.execute(
+        insert(Event)
+        .values([event_row(e) for e in events])
+        .on_conflict_do_nothing(index_elements=[Event.message_id])
+        .returning(Event.id, Event.message_id)
+    )).all()
+    if not inserted:
+        await db.rollback()
+        return {}
+
+    # rows already stored by an earlier run are skipped by the unique index
+    inserted = { message_id : id for id, message_id in inserted }
+    deltas = {}
+    for event in events:
+        if event.message_id in inserted:
+            summary.created(event, deltas)
+    await db.execute(summary.statement(deltas))
+    await db.execute(changes.notify(inserted.values(), changes.CREATED))
+
+    # auto-approved tickets go through the same checkout queue as /buy-ticket
+    to_checkout = [inserted[message_id] for message_id in approved if message_id in inserted]
+    if to_checkout:
+        await db.execute(checkout.enqueue(to_checkout))
+        await db.execute(checkout.wake())
+    await db.commit()
+
+    MESSAGES.labels("stored").inc(len(inserted))
+    now = datetime.now()
+    for event in events:
+        if event.message_id in approved and event.message_id in inserted:
+            DROP_TO_CHECKOUT_SECONDS.observe((now - event.posted_at).total_seconds())
+    return inserted
+
+
+def bad_row(e):
+    """
+    True if the database rejected the row itself, storing it again can't work.
+    """
+    if isinstance(e, (exc.DataError, exc.IntegrityError)):
+        return True
+    # failed before reaching the database, e.g. a value the column type can't take
+    return isinstance(e, exc.StatementError) and not isinstance(e, exc.DBAPIError)
+
+
+async def persist(events, approved):
+    """
+    One bulk insert and one commit per poll cycle, returns {message_id: id} of the inserted rows.
+    If the batch has a bad row, rows are retried one by one so it doesn't lose the rest.
+    Raises if the rows couldn't be stored (database down, timeout ...), bad rows are only logged and dropped.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            return await save(db, events, approved)
+        except Exception as e:
+            await db.rollback()
+            if not bad_row(e):
+                raise
+            logger.error(e)
+
+        stored = {}
+        if len(events) == 1:
+            MESSAGES.labels("invalid").inc()
+            return stored
+
+        for event in events:
+            try:
+                stored.update(await save(db, [event], approved))
+            except Exception as e:
+                await db.rollback()
+                if not bad_row(e):
+                    raise
+                MESSAGES.labels("invalid").inc()
+                logger.error(e)
+        return stored
+
+
+async def load_cursor(db):
+    state = await db.get(ListenerState, "relay_since")
+    if state and state.value:
+        relay["since"] = int(state.value)
+
+
+async def save_cursor():
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            insert(ListenerState)
+            .values(name="relay_since", value=str(relay["since"]), updated_at=datetime.utcnow())
+            .on_conflict_do_update(
+                index_elements=[ListenerState.name],
+                set_={"value": str(relay["since"]), "updated_at": datetime.utcnow()},
+            )
+        )
+        await db.commit()
+
+
+async def fetch_messages():
+    """
+    (messages posted since the cursor, their ETag), None if the relay has nothing new.
+    """
+    params = {SINCE_PARAM: relay["since"] - SINCE_OVERLAP} if relay["since"] else None
+    headers = {"If-None-Match": relay["etag"]} if relay["etag"] else None
+    async with outbound.client("discord_relay").get(
+        os.getenv('DISCORD_SERVER_SIDE_URL'),
+        params=params,
+        headers=headers,
+    ) as response:
+        if response.status == 304:
+            return None
+        if response.status != 200:
+            logger.error(f"Error: {response.status} {await response.text()}")
+            return None
+        return await response.json(content_type=None), response.headers.get("ETag")
+
+
+def accept(messages):
+    """
+    (message_id, posted_at, message) of the messages not seen before.
+    """
+    items = []
+    for msg in messages:
+        id = msg.get("messageId")
+        try:
+            posted_at = int(msg.get("timestamp"))
+        except:
+            posted_at = None
+
+        # older than the in-memory window means handled before (or before we started)
+        if not id or not posted_at or posted_at < max(start_time.timestamp(), ids.cutoff()):
+            continue
+
+        # checked and marked before any await, so a message is never handled twice
+        if not ids.add(id, posted_at):
+            MESSAGES.labels("duplicate").inc()
+            continue
+
+        items.append((id, posted_at, msg))
+    return items
+
+
+async def ingest(items):
+    """
+    Parse, enrich and store (message_id, posted_at, message) items, returns how many were new.
+    Raises if they couldn't be stored, so the caller can take them again.
+    """
+    batch = []
+    for id, posted_at, msg in items:
+        try:
+            batch.append((id, posted_at, parse_message(msg)))
+        except Exception as e:
+            MESSAGES.labels("invalid").inc()
+            logger.error(e)
+
+    CYCLE_MESSAGES.observe(len(batch))
+    if not batch:
+        return 0
+
+    # one IN (...) query per table for the whole batch, the rest comes from the lookup cache
+    async with AsyncSessionLocal() as db:
+        stored = set((await db.execute(queries.stored_message_ids([id for id, _, _ in batch]))).scalars().all())
+        batch = [item for item in batch if item[0] not in stored]
+        if not batch:
+            return 0
+        event_details = await lookups.event_details_async(db, {data["Event ID"] for _, _, data in batch})
+        cvvs = await lookups.bot_cvvs_async(db, {data["Account"] for _, _, data in batch})
+
+    events = []
+    for id, posted_at, data in batch:
+        try:
+            events.append(build_event(id, posted_at, data, event_details, cvvs))
+        except Exception as e:
+            logger.error(e)
+
+    # approved tickets are committed to the checkout queue first, enrichment only adds prices afterwards
+    approved = {event.message_id for event in events if approve(event)}
+    if events:
+        stored = await persist(events, approved)
+        logger.info(f"Stored {len(stored)} new messages")
+        if stored:
+            # in the background, so it doesn't hold up the next poll's drops either
+            task = asyncio.create_task(enrich_stored([e for e in events if e.message_id in stored], stored, event_details))
+            enrichments.add(task)
+            task.add_done_callback(enrichments.discard)
+
+    return len(batch)
+
+
+async def publish(items):
+    """
+    Leader side of the sharded mode: queue the new messages for all workers instead of ingesting them here.
+    """
+    if items:
+        async with AsyncSessionLocal() as db:
+            await db.execute(inbox.push(items))
+            await db.commit()
+    return len(items)
+
+
+async def work_inbox():
+    """
+    Claim and ingest one batch from listener_inbox, returns the batch size.
+    """
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(inbox.claim())).all()
+        if not rows:
+            await db.rollback()
+            return 0
+        # a batch claimed again after a crash is dropped by the stored message_id check in ingest,
+        # one that failed to store is rolled back into the inbox by the raise
+        await ingest([(row.message_id, row.posted_at, row.payload) for row in rows])
+        await db.commit()
+        return len(rows)
+
+
+class Leadership:
+    """
+    Relay polling leader, elected with a session-level advisory lock on a connection of its own.
+    The lock goes away with the connection, so a crashed leader is replaced within one cycle.
+    """
+
+    def __init__(self):
+        self.conn = None
+
+    async def check(self):
+        """
+        True while this process is the leader, tries to become it otherwise.
+        """
+        try:
+            if self.conn is not None:
+                await self.conn.execute(text("SELECT 1"))
+                await self.conn.commit()
+                return True
+
+            conn = await async_engine.connect()
+            won = (await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": inbox.LEADER_LOCK})).scalar()
+            await conn.commit()
+            if not won:
+                await conn.close()
+                return False
+            self.conn = conn
+            return True
+        except Exception as e:
+            logger.error(e)
+            await self.release()
+            return False
+
+    async def release(self):
+        if self.conn is not None:
+            try:
+                await self.conn.invalidate() # never hand a connection holding the lock back to the pool
+            except Exception as e:
+                logger.error(e)
+            self.conn = None
+
+
+async def run(handler=ingest):
+    """
+    One poll cycle, returns the number of new messages.
+    """
+    try:
+        fetched = await fetch_messages()
+        if not fetched:
+            return 0
+        messages, etag = fetched
+
+        items = accept(messages)
+        try:
+            new = await handler(items)
+        except Exception:
+            # not stored: unmarked and the cursor and ETag stay put, so the next poll fetches them again
+            ids.forget([id for id, _, _ in items])
+            raise
+
+        # moved only after the messages are stored, a crash in between refetches them and the dedup skips them
+        relay["etag"] = etag
+        since = max((int(m["timestamp"]) for m in messages if str(m.get("timestamp", "")).isdigit()), default=None)
+        if since and (not relay["since"] or since > relay["since"]):
+            relay["since"] = since
+            await save_cursor()
+        return new
+    except Exception as e:
+        logger.error(e)
+        return 0
+
+
+async def sharded(leadership):
+    """
+    One cycle of the sharded mode: poll the relay if leader, then take a share of the inbox.
+    """
+    global start_time
+    new = 0
+    was_leader = leadership.conn is not None
+    if await leadership.check():
+        if not was_leader:
+            logger.info("Took over polling the relay")
+            async with AsyncSessionLocal() as db:
+                await load_cursor(db)
+            # the previous leader queued everything up to its cursor
+            if relay["since"]:
+                start_time = datetime.fromtimestamp(relay["since"] - SINCE_OVERLAP)
+        new += await run(publish)
+
     while True:
-        logger.info("Get messages...")
-        run()
-        time.sleep(3)
-except KeyboardInterrupt:
-    logger.info("Shutting down ...")
+        try:
+            claimed = await work_inbox()
+        except Exception as e:
+            logger.error(e)
+            return new
+        new += claimed
+        if claimed < inbox.CLAIM_BATCH:
+            return new
+
+
+async def main():
+    global start_time
+    stats_at = time.monotonic()
+    metrics.instrument_engine(async_engine.sync_engine, "async")
+    metrics.register_stats(
+        caches=lambda: lookups.stats() + [automatiq.listings_cache.stats()],
+        outbound=outbound.stats,
+    )
+    try:
+        start_http_server(METRICS_PORT)
+    except OSError as e: # another listener on this host already has the port
+        logger.error(f"Metrics port {METRICS_PORT}: {e}")
+    async with AsyncSessionLocal() as db:
+        await rules.reload(db)
+        await load_cursor(db)
+        # resume where the previous run stopped, archived messages included, the stored message_id check drops the overlap
+        last_posted_at = (await db.execute(queries.last_posted_at())).scalar()
+        if last_posted_at:
+            start_time = last_posted_at
+        if relay["since"]:
+            start_time = max(start_time, datetime.fromtimestamp(relay["since"] - SINCE_OVERLAP))
+    leadership = Leadership()
+    # a second single-mode listener would ingest and check out everything twice
+    if not SHARDED and not await leadership.check():
+        logger.error("Another listener is polling the relay, run every listener with LISTENER_MODE=sharded to scale out")
+        return
+    refresher = asyncio.create_task(rules.keep_fresh())
+    interval = POLL_MAX
+    try:
+        while True:
+            with CYCLE_SECONDS.time():
+                new = await (sharded(leadership) if SHARDED else run())
+            interval = POLL_MIN if new else min(interval * 2, POLL_MAX)
+            if time.monotonic() - stats_at >= STATS_INTERVAL:
+                logger.info(f"Automatiq stats: {automatiq.stats()}")
+                logger.info(f"Outbound stats: {outbound.stats()}")
+                stats_at = time.monotonic()
+            await asyncio.sleep(interval)
+    finally:
+        await leadership.release()
+        await outbound.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Shutting down ...")
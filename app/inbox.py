@@ -0,0 +1,41 @@
+import os
+from datetime import datetime as dt
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+try:
+    from .db import ListenerInbox
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    from db import ListenerInbox
+
+
+# Sharded listener: the leader (whoever holds LEADER_LOCK) polls the relay and pushes messages here,
+# every listener process claims batches with SKIP LOCKED and ingests them.
+load_dotenv()
+LEADER_LOCK = 726002 # pg advisory lock, next to the migrations one
+CLAIM_BATCH = int(os.getenv("LISTENER_CLAIM_BATCH", 20))
+
+
+def push(items):
+    """
+    Queue (message_id, posted_at, message) items, messages already waiting are skipped.
+    """
+    now = dt.utcnow()
+    return insert(ListenerInbox).values([
+        {"message_id": id, "posted_at": posted_at, "payload": msg, "created_at": now}
+        for id, posted_at, msg in items
+    ]).on_conflict_do_nothing(index_elements=[ListenerInbox.message_id])
+
+
+def claim(batch_size=CLAIM_BATCH):
+    """
+    Take up to batch_size messages off the inbox. The rows stay locked until the claiming
+    transaction commits, a worker that dies before that hands them back to the others.
+    """
+    ids = select(ListenerInbox.id) \
+        .order_by(ListenerInbox.id) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True)
+    return delete(ListenerInbox) \
+        .where(ListenerInbox.id.in_(ids)) \
+        .returning(ListenerInbox.message_id, ListenerInbox.posted_at, ListenerInbox.payload)
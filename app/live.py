@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from .changes import CHANNEL, DELETED
+from .db import DATABASE_URL
+
+
+logger = logging.getLogger(__name__)
+DEBOUNCE = 0.1 # seconds to collect notifications into one row load
+QUEUE_SIZE = 100
+
+
+class Broadcaster:
+    """
+    Fans out events_changed notifications to the /items/stream subscribers.
+    One LISTEN connection and one row load per batch of changes, no matter how many tabs are open.
+    The same notifications carry the shared events version the polling endpoints use as their ETag,
+    so every worker and replica answers a poll with the same tag.
+    """
+
+    def __init__(self, load_items):
+        self.load_items = load_items
+        self.subscribers = {}
+        self.loop = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.version = 0
+        self.listening = False
+
+    def start(self, loop):
+        self.loop = loop
+        self.thread = threading.Thread(target=self._run, name="events-broadcaster", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def subscribe(self, event_id):
+        queue = asyncio.Queue(QUEUE_SIZE)
+        self.subscribers[queue] = event_id
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    def etag(self):
+        """
+        Weak ETag of the current events version, None while LISTEN is down and changes could be missed.
+        """
+        if not self.listening:
+            return None
+        return f'W/"{self.version}"'
+
+    def _deliver(self, items):
+        for queue, event_id in list(self.subscribers.items()):
+            rows = [i for i in items if event_id in (None, "Any") or i["event_id"] in (event_id, None)]
+            if not rows:
+                continue
+            try:
+                queue.put_nowait(rows)
+            except asyncio.QueueFull:
+                # slow consumer: close its stream, the page resyncs on reconnect
+                self.unsubscribe(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _publish(self, pending):
+        try:
+            items = self.load_items(list(pending))
+        except Exception as e:
+            logger.error(e)
+            return
+
+        for item in items:
+            item["change"] = pending.get(item["id"])
+        # archived rows are gone from events, pages only need the id to drop them
+        found = {item["id"] for item in items}
+        items += [
+            {"id": id, "event_id": None, "is_active": False, "change": kind}
+            for id, kind in pending.items()
+            if kind == DELETED and id not in found
+        ]
+        self.loop.call_soon_threadsafe(self._deliver, items)
+
+    def _listen(self, conn):
+        pending = {}
+        deadline = None
+        while not self.stop_event.is_set():
+            timeout = max(deadline - time.monotonic(), 0) if deadline else 5
+            if select.select([conn], [], [], timeout)[0]:
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        payload = json.loads(notify.payload)
+                    except ValueError:
+                        continue
+                    self.version = max(self.version, payload.get("v", 0))
+                    for id in payload.get("ids", []):
+                        # a created row keeps its "created" kind even if updated in the same batch
+                        pending.setdefault(id, payload.get("kind"))
+                if pending and not deadline:
+                    deadline = time.monotonic() + DEBOUNCE
+
+            if deadline and time.monotonic() >= deadline:
+                self._publish(pending)
+                pending = {}
+                deadline = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(DATABASE_URL)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                # read after LISTEN, so changes committed while disconnected are in it and later ones arrive as notifies
+                cursor.execute("SELECT version FROM events_version WHERE id = 1")
+                row = cursor.fetchone()
+                self.version = row[0] if row else 0
+                self.listening = True
+                self._listen(conn)
+            except Exception as e:
+                logger.error(e)
+                time.sleep(3)
+            finally:
+                self.listening = False
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,137 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import select
+try:
+    from .db import EventDetails, EventSummary, BotAccount
+    from .cache import MISSING, TTLCache
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    from db import EventDetails, EventSummary, BotAccount
+    from cache import MISSING, TTLCache
+
+
+load_dotenv()
+TTL = int(os.getenv("LOOKUP_CACHE_TTL", 300))
+# unknown keys expire sooner, a row ops add for a new event shows up in every process within this
+MISS_TTL = int(os.getenv("LOOKUP_CACHE_MISS_TTL", 10))
+MAXSIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 10000))
+OPTIONS_TTL = int(os.getenv("EVENT_OPTIONS_TTL", 60))
+
+# event_id -> (event_name, automatiq_event_id), None for unknown ids
+event_details_cache = TTLCache("event_details", MAXSIZE, TTL)
+# email -> cvv, None for unknown accounts
+bot_accounts_cache = TTLCache("bot_accounts", MAXSIZE, TTL)
+# "all" -> ([(event_id, event_name)] sorted by name, {event_id}) for the tickets page filter
+event_options_cache = TTLCache("event_options", 1, OPTIONS_TTL)
+
+
+def _cached(cache, keys):
+    found = {}
+    missing = set()
+    for key in keys:
+        if key is None:
+            continue
+        value = cache.get(key)
+        if value is MISSING:
+            missing.add(key)
+        else:
+            found[key] = value
+    return found, missing
+
+
+def _store(cache, found, missing, loaded):
+    for key in missing:
+        # unknown keys are cached too so they don't hit the DB on every call, but only briefly
+        value = loaded.get(key)
+        cache.set(key, value, None if value is not None else MISS_TTL)
+        found[key] = value
+    return found
+
+
+def event_details_query(ids):
+    return select(EventDetails.event_id, EventDetails.event_name, EventDetails.automatiq_event_id) \
+        .where(EventDetails.event_id.in_(ids))
+
+
+def event_details_rows(rows):
+    return { row.event_id : (row.event_name, row.automatiq_event_id) for row in rows }
+
+
+def bot_accounts_query(emails):
+    return select(BotAccount.email, BotAccount.cvv).where(BotAccount.email.in_(emails))
+
+
+def bot_accounts_rows(rows):
+    return { row.email : row.cvv for row in rows }
+
+
+def event_details(db, event_ids):
+    found, missing = _cached(event_details_cache, event_ids)
+    loaded = event_details_rows(db.execute(event_details_query(missing)).all()) if missing else {}
+    return _store(event_details_cache, found, missing, loaded)
+
+
+async def event_details_async(db, event_ids):
+    found, missing = _cached(event_details_cache, event_ids)
+    loaded = event_details_rows((await db.execute(event_details_query(missing))).all()) if missing else {}
+    return _store(event_details_cache, found, missing, loaded)
+
+
+def event_names(db, event_ids):
+    return { k : v[0] for k, v in event_details(db, event_ids).items() if v }
+
+
+async def event_names_async(db, event_ids):
+    return { k : v[0] for k, v in (await event_details_async(db, event_ids)).items() if v }
+
+
+def bot_cvvs(db, emails):
+    found, missing = _cached(bot_accounts_cache, emails)
+    loaded = bot_accounts_rows(db.execute(bot_accounts_query(missing)).all()) if missing else {}
+    return _store(bot_accounts_cache, found, missing, loaded)
+
+
+async def bot_cvvs_async(db, emails):
+    found, missing = _cached(bot_accounts_cache, emails)
+    loaded = bot_accounts_rows((await db.execute(bot_accounts_query(missing))).all()) if missing else {}
+    return _store(bot_accounts_cache, found, missing, loaded)
+
+
+async def event_options(db):
+    """
+    Every event id that has tickets, with its name, from the per-event summaries instead of a DISTINCT over events.
+    """
+    cached = event_options_cache.get("all")
+    if cached is not MISSING:
+        return cached[0]
+
+    event_ids = (await db.execute(
+        select(EventSummary.event_id).where(EventSummary.total_count > 0)
+    )).scalars().all()
+    names = await event_names_async(db, event_ids)
+    options = sorted(((id, names.get(id)) for id in event_ids), key=lambda o: ((o[1] or "").lower(), o[0]))
+    event_options_cache.set("all", (options, set(event_ids)))
+    return options
+
+
+def seen_event_ids(event_ids):
+    # a ticket for an event the filter doesn't list yet drops the cached list
+    cached = event_options_cache.get("all")
+    if cached is not MISSING and not cached[1].issuperset(id for id in event_ids if id is not None):
+        event_options_cache.invalidate()
+
+
+def invalidate(event_id=MISSING, email=MISSING):
+    if event_id is MISSING and email is MISSING:
+        event_details_cache.invalidate()
+        bot_accounts_cache.invalidate()
+        event_options_cache.invalidate()
+        return
+    if event_id is not MISSING:
+        event_details_cache.invalidate(event_id)
+        event_options_cache.invalidate() # the name may have changed
+    if email is not MISSING:
+        bot_accounts_cache.invalidate(email)
+
+
+def stats():
+    return [event_details_cache.stats(), bot_accounts_cache.stats(), event_options_cache.stats()]
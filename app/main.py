@@ -1,17 +1,28 @@
 import os
+import asyncio
+import json
 import logging
 import math
 import random
+import time
+from contextlib import asynccontextmanager
+from typing import Literal
+from urllib.parse import urlencode
 from fastapi import FastAPI, Depends, Request, Query
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc
-from .db import Event, EventDetails, BotAccount, get_db
-from .schemas import EventCreate
+from fastapi.responses import JSONResponse, HTMLResponse, ORJSONResponse, RedirectResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import Event, EventSummary, CheckoutJob, SessionLocal, engine, async_engine, get_async_db
+from .schemas import EventCreate, ItemsPage, DealsPage
+from . import changes, checkout, lookups, metrics, queries, summary
+from .live import Broadcaster
+from .migrations import migrate
+from .normalize import row_number, section_bucket
+from .queries import ITEM_COLUMNS, ITEM_KEYS, NO_FILTERS, PER_PAGE, SORTS
 from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import case, func
-import requests
+from sqlalchemy import func, select, update
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -27,98 +38,258 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    migrate()
+    broadcaster.start(asyncio.get_running_loop())
+    yield
+    broadcaster.stop()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
+
+
+def fragment(name, **context):
+    return Markup(templates.get_template(name).render(**context))
+
+
+# static parts of the pages, rendered once instead of on every request
+templates.env.globals["nav"] = {page : fragment("fragments/nav.html", active_page=page) for page in ("tickets", "deals", "events")}
+templates.env.globals["tickets_head"] = fragment("fragments/tickets_head.html")
+event_select = {"options": None, "html": None}
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["GET"],
     allow_headers=["*"],
 )
-PER_PAGE = 25
+DEALS_LIMIT = 20
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency", ["method", "route", "status"])
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements per request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "DB time per request", ["route"])
+metrics.instrument_engine(engine, "sync")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+metrics.register_stats(caches=lookups.stats)
+
+
+@app.middleware("http")
+async def observe(request: Request, call_next):
+    db = [0, 0.0]
+    token = metrics.request_db.set(db)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.request_db.reset(token)
+        # the route template, not the raw path, keeps ids out of the label values
+        route = request.scope.get("route")
+        route = route.path if route else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route, status).observe(time.perf_counter() - started)
+        REQUEST_DB_QUERIES.labels(route).observe(db[0])
+        REQUEST_DB_SECONDS.labels(route).observe(db[1])
+
+
+def to_items(rows, event_names):
+    items = []
+    for row in rows:
+        item = dict(zip(ITEM_KEYS, row))
+        # epoch seconds, the page renders the countdown so responses stay the same until the rows change
+        item["expire_at"] = int(row.expire_at.timestamp()) if row.expire_at else None
+        item["event_name"] = event_names.get(row.event_id)
+        items.append(item)
+
+    return items
+
+
+def load_items(ids):
+    # runs on the broadcaster's thread, so it stays on the sync engine
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(*ITEM_COLUMNS).where(Event.id.in_(ids))).all()
+        lookups.seen_event_ids({row.event_id for row in rows})
+        return to_items(rows, lookups.event_names(db, {row.event_id for row in rows}))
+    finally:
+        db.close()
+
+
+broadcaster = Broadcaster(load_items)
+
+
+async def event_select_html(db):
+    # re-rendered only when the cached options list is rebuilt
+    options = await lookups.event_options(db)
+    if options is not event_select["options"]:
+        event_select["html"] = fragment("fragments/event_options.html", options=options)
+        event_select["options"] = options
+    return event_select["html"]
+
+
+def not_modified(request, response):
+    """
+    Tag the response with the events version, or return a 304 if the client already has this version.
+    """
+    response.headers["Cache-Control"] = "no-cache" # browsers revalidate with If-None-Match on every poll
+    tag = broadcaster.etag()
+    if not tag:
+        return None
+
+    response.headers["ETag"] = tag
+    if tag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": tag, "Cache-Control": "no-cache"})
+    return None
+
+
+def ticket_filters(
+    section: str = Query(None), # section bucket, 100x..500x or a named section
+    max_row: int = Query(None, ge=1),
+    min_roi: float = Query(None),
+    unexpired: bool = Query(False),
+    sort: Literal["id", "roi", "expire"] = Query("id"),
+):
+    return {"section": section, "max_row": max_row, "min_roi": min_roi, "unexpired": unexpired, "sort": sort}
 
 
-def expire_at(target_time: datetime) -> str:
-    now = datetime.now()
-    diff = target_time - now
+def filter_query(filters):
+    """
+    The non-default filters as a query string, for the page links.
+    """
+    return urlencode({k : v for k, v in filters.items() if v != NO_FILTERS[k]})
 
-    if diff.total_seconds() <= 0:
-        return "expired"
 
-    hours, remainder = divmod(int(diff.total_seconds()), 3600)
-    minutes, seconds = divmod(remainder, 60)
+async def tickets_page(db, page, event_id, filters, after_id=None, before_id=None):
+    query, total = queries.tickets(page, event_id, filters, after_id, before_id)
+    sort = filters["sort"] in SORTS
+    rows = (await db.execute(query)).all()
+    if before_id and not sort:
+        rows.reverse()
 
-    return f"{hours:02}:{minutes:02}:{seconds:02}"
+    total = rows[0].total if rows else (await db.execute(select(total))).scalar()
 
+    cursors = {
+        "before_id": rows[0].id if rows and not sort else None,
+        "after_id": rows[-1].id if rows and not sort else None,
+    }
+    events = to_items(rows, await lookups.event_names_async(db, {row.event_id for row in rows}))
 
-@app.get("/items/")
-def get_items(db: Session = Depends(get_db), page: int = Query(1, ge=1), event_id: str = Query(...)):
-    offset = (page - 1) * PER_PAGE
-    query = db.query(Event).filter(Event.is_active == True)
-    if event_id and event_id != "Any":
-        query = query.filter(Event.event_id == event_id)
-    total = query.count()
-    
-    query = db.query(Event) \
-        .filter(Event.is_active == True)
-    if event_id and event_id != "Any":
-        query = query.filter(Event.event_id == event_id)
-        
-    _events = query.order_by(asc(Event.id)) \
-        .order_by(asc(Event.created_at)) \
-        .offset(offset) \
-        .limit(PER_PAGE)  \
-        .all()
-
-    event_details = db.query(EventDetails).all()
-    event_details = { row.event_id : row.event_name for row in event_details }
-
-    events = []
-    for e in _events:
-        e.expire_at = expire_at(e.expire_at)
-        e.event_name = event_details.get(e.event_id)
-        events.append(e)
+    return events, total, cursors
+
+
+async def deals_page(db, limit, event_id=None, per_event=None):
+    rows = (await db.execute(queries.deals(limit, event_id, per_event))).all()
+    return to_items(rows, await lookups.event_names_async(db, {row.event_id for row in rows}))
+
+
+async def events_page(db, page):
+    total = (await db.execute(select(func.count(EventSummary.event_id)))).scalar()
+    _events = (await db.execute(queries.events(page))).scalars().all()
+
+    event_details = await lookups.event_names_async(db, {e.event_id for e in _events})
+    events = [
+        {
+            "event_id": e.event_id,
+            "event_name": event_details.get(e.event_id),
+            "full_price_total": round(e.full_price_total, 2),
+            "new_count": e.new_count,
+            "pending_count": e.pending_count,
+            "scheduled_count": e.scheduled_count,
+            "failed_count": e.failed_count,
+            "active_count": e.active_count,
+        }
+        for e in _events
+    ]
+
+    return events, total
+
+
+@app.get("/items/", response_model=ItemsPage, response_class=ORJSONResponse)
+async def get_items(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    page: int = Query(1, ge=1),
+    event_id: str = Query(...),
+    after_id: int = Query(None, ge=0),
+    before_id: int = Query(None, ge=1),
+    filters: dict = Depends(ticket_filters),
+):
+    # what is unexpired changes with the clock, not with the events version
+    cached = not_modified(request, response) if not filters["unexpired"] else None
+    if cached:
+        return cached
+
+    events, total, cursors = await tickets_page(db, page, event_id, filters, after_id, before_id)
 
     return {
         "items": events,
         "page": page,
         "per_page": PER_PAGE,
         "total": total,
+        "cursors": cursors,
     }
 
 
-@app.get("/events/")
-def get_items(db: Session = Depends(get_db), page: int = Query(1, ge=1)):
-    offset = (page - 1) * PER_PAGE
-    total = db.query(Event.event_id) \
-        .distinct() \
-        .count()
-    
-    _events = (
-        db.query(
-            Event.event_id,
-            func.coalesce(
-                func.sum(
-                    case(
-                        (Event.status == Event.STATUS_SCHEDULED, Event.full_price),
-                        else_=0
-                    )
-                ),
-                0
-            ).label("full_price_total")
-        )
-        .group_by(Event.event_id)
-        .limit(PER_PAGE)
-        .offset(offset)
-        .all()
+@app.get("/deals/", response_model=DealsPage, response_class=ORJSONResponse)
+async def get_deals(
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(DEALS_LIMIT, ge=1, le=100),
+    event_id: str = Query("Any"),
+    per_event: int = Query(None, ge=1, le=10),
+):
+    # no ETag here, tickets drop out of the list as they expire without a new events version
+    return {"items": await deals_page(db, limit, event_id, per_event), "limit": limit}
+
+
+@app.get("/items/stream")
+async def items_stream(request: Request, event_id: str = Query("Any")):
+    queue = broadcaster.subscribe(event_id)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    items = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if items is None: # dropped as a slow consumer
+                    break
+                yield f"data: {json.dumps(items)}\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    event_details = db.query(EventDetails).all()
-    event_details = { row.event_id : row.event_name for row in event_details }
-    events = [
-        {"event_id": eid, "event_name": event_details.get(eid), "full_price_total": round(total, 2)}
-        for eid, total in _events
-    ]
+
+@app.get("/events/")
+async def get_items(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    page: int = Query(1, ge=1),
+):
+    cached = not_modified(request, response)
+    if cached:
+        return cached
+
+    events, total = await events_page(db, page)
 
     return {
         "events": events,
@@ -128,59 +299,56 @@ def get_items(db: Session = Depends(get_db), page: int = Query(1, ge=1)):
     }
 
 
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"caches": lookups.stats()}
+
+
+@app.post("/cache/invalidate")
+def cache_invalidate(event_id: str = Query(None), email: str = Query(None)):
+    if event_id is None and email is None:
+        lookups.invalidate()
+    else:
+        if event_id is not None:
+            lookups.invalidate(event_id=event_id)
+        if email is not None:
+            lookups.invalidate(email=email)
+    return {"success": True}
+
+
 @app.get("/")
 def index():
     return RedirectResponse("/tickets?page=1&event_id=Any")
 
 @app.get("/tickets", response_class=HTMLResponse)
-def tickets(
+async def tickets(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1),
-    event_id: str = Query(...)
+    event_id: str = Query(...),
+    after_id: int = Query(None, ge=0),
+    before_id: int = Query(None, ge=1),
+    filters: dict = Depends(ticket_filters),
 ):
-    offset = (page - 1) * PER_PAGE
-    query = db.query(Event).filter(Event.is_active == True)
-    if event_id and event_id != "Any":
-        query = query.filter(Event.event_id == event_id)
-    total = query.count()
-
-    query = db.query(Event) \
-        .filter(Event.is_active == True)
-    if event_id and event_id != "Any":
-        query = query.filter(Event.event_id == event_id)
-        
-    _events = query.order_by(asc(Event.id)) \
-        .order_by(asc(Event.created_at)) \
-        .offset(offset) \
-        .limit(PER_PAGE)  \
-        .all()
-    
-    event_details = db.query(EventDetails).all()
-    event_details = { row.event_id : row.event_name for row in event_details }
-
-    events = []
-    for e in _events:
-        e.expire_at = expire_at(e.expire_at)
-        e.event_name = event_details.get(e.event_id)
-        events.append(e)
-
-    unique_events = (
-        db.query(Event)
-        .distinct(Event.event_name)
-        .order_by(asc(Event.event_name))
-        .all()
-    )
+    events, total, cursors = await tickets_page(db, page, event_id, filters, after_id, before_id)
 
     return templates.TemplateResponse(
         "tickets.html",
         {
-            "unique_events": unique_events,
+            "event_options": await event_select_html(db),
             "events": events,
             "total": total,
             "per_page": PER_PAGE,
             "page": page,
+            "cursors": cursors,
             "event_id": event_id,
+            "filters": filters,
+            "filter_query": filter_query(filters),
             "request": request,
             "Event": Event,
             "active_page": "tickets"
@@ -188,43 +356,36 @@ def tickets(
     )
 
 
-@app.get("/events", response_class=HTMLResponse)
-def events(
+@app.get("/deals", response_class=HTMLResponse)
+async def deals(
     request: Request,
-    db: Session = Depends(get_db),
-    page: int = Query(1, ge=1),
+    db: AsyncSession = Depends(get_async_db),
+    limit: int = Query(DEALS_LIMIT, ge=1, le=100),
+    event_id: str = Query("Any"),
+    per_event: int = Query(None, ge=1, le=10),
 ):
-    offset = (page - 1) * PER_PAGE
-    total = (
-        db.query(Event.event_id)
-        .distinct()
-        .count()
-    )
-    _events = (
-        db.query(
-            Event.event_id,
-            func.coalesce(
-                func.sum(
-                    case(
-                        (Event.status == Event.STATUS_SCHEDULED, Event.full_price),
-                        else_=0
-                    )
-                ),
-                0
-            ).label("full_price_total")
-        )
-        .group_by(Event.event_id)
-        .limit(PER_PAGE)
-        .offset(offset)
-        .all()
+    return templates.TemplateResponse(
+        "deals.html",
+        {
+            "event_options": await event_select_html(db),
+            "events": await deals_page(db, limit, event_id, per_event),
+            "limit": limit,
+            "event_id": event_id,
+            "per_event": per_event,
+            "request": request,
+            "Event": Event,
+            "active_page": "deals"
+        },
     )
 
-    event_details = db.query(EventDetails).all()
-    event_details = { row.event_id : row.event_name for row in event_details }
-    events = [
-        {"event_id": eid, "event_name": event_details.get(eid), "full_price_total": round(total, 2)}
-        for eid, total in _events
-    ]
+
+@app.get("/events", response_class=HTMLResponse)
+async def events(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    page: int = Query(1, ge=1),
+):
+    events, total = await events_page(db, page)
 
     return templates.TemplateResponse(
         "events.html",
@@ -240,7 +401,7 @@ def events(
 
 
 @app.post("/event")
-def create_event(request: EventCreate, db: Session = Depends(get_db)):
+async def create_event(request: EventCreate, db: AsyncSession = Depends(get_async_db)):
     try:
         data = dict()
         try:
@@ -270,23 +431,20 @@ def create_event(request: EventCreate, db: Session = Depends(get_db)):
                 logger.error(error)
                 return JSONResponse({"error": error}, 500)
 
-        event_details = db.query(EventDetails).filter(EventDetails.event_id == data["Event ID"]).first()
-        event_name = event_details.event_name if event_details else None
-
-        bot = db.query(BotAccount).filter(BotAccount.email == data["Account"]).first()
-        cvv = bot.cvv if bot else None
+        event_name = (await lookups.event_names_async(db, [data["Event ID"]])).get(data["Event ID"])
+        cvv = (await lookups.bot_cvvs_async(db, [data["Account"]])).get(data["Account"])
 
         full_price = round(float(data["Full price"]), 2)
         amount = int(data["Amount"])
         if not full_price or not amount:
             error = "Invalid full price or amount"
-            logger(error)
+            logger.error(error)
             return JSONResponse({"error": error}, 500)
         price_plus_fees = round(full_price / amount, 2)
 
-        expire_at = None
+        expire_ts = None
         try:
-            expire_at = datetime.fromtimestamp(int(data["Expiration"].replace("<t:", "").replace(":R>", "")))
+            expire_ts = int(data["Expiration"].replace("<t:", "").replace(":R>", ""))
         except Exception as e:
             logger.error(e)
             return JSONResponse({"error": "Internal server error"}, 500)
@@ -296,19 +454,24 @@ def create_event(request: EventCreate, db: Session = Depends(get_db)):
             event_name=event_name,
             bot_email=data["Account"],
             section=data["Section"],
+            section_bucket=section_bucket(data["Section"]),
             row=data["Row"],
+            row_num=row_number(data["Row"]),
             price=float(data["Price"]),
             amount=int(data["Amount"]),
             full_price=float(data["Full price"]),
             price_plus_fees=price_plus_fees,
-            expire_at=expire_at,
+            expire_at=datetime.fromtimestamp(expire_ts),
+            expire_ts=expire_ts,
             encsoft_url=data["Full checkout"],
             cvv=cvv,
             status=Event.STATUS_NEW
         )
         db.add(event)
-        db.commit()
-        db.refresh(event)
+        await db.flush()
+        await summary.apply_async(db, summary.created(event))
+        await db.execute(changes.notify([event.id], changes.CREATED))
+        await db.commit()
 
         return {"id": event.id}
     except Exception as e:
@@ -317,50 +480,68 @@ def create_event(request: EventCreate, db: Session = Depends(get_db)):
     return JSONResponse({"error": "Internal server error"}, 500)
 
 @app.post("/buy-ticket/{event_id}")
-def buy_ticket(event_id: int, db: Session = Depends(get_db)):
-    event = db.query(Event).filter(Event.id == event_id).first()
-    if not event or event.status != Event.STATUS_NEW: # prevent duplicated request from miltiple users
+async def buy_ticket(event_id: int, db: AsyncSession = Depends(get_async_db)):
+    # atomic new -> pending claim, only one request (from any worker or replica) wins a ticket
+    event = (await db.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.status == Event.STATUS_NEW)
+        .values(status=Event.STATUS_PENDING, updated_at=datetime.utcnow())
+        .returning(Event.id, Event.event_id, Event.status, Event.full_price, Event.encsoft_url, Event.cvv)
+    )).first()
+    if not event: # prevent duplicated request from miltiple users
+        await db.rollback()
         return {}
 
     if not event.encsoft_url or not event.cvv:
+        await db.rollback() # release the claim, the ticket stays new
         return JSONResponse({"error": "Event checkout url or CVV is empty"}, 500)
     
     try:
-        resp = requests.post(
-            url=os.getenv("CHECKOUT_BOT_API_URL"),
-            json={
-                "encsoft_url": event.encsoft_url,
-                "cvv": event.cvv,
-            }
-        )
+        await summary.apply_async(db, summary.status_changed(event, Event.STATUS_NEW))
+        await db.execute(changes.notify([event.id], changes.UPDATED))
 
-        if resp.status_code == 200:
-            event.status = Event.STATUS_SCHEDULED
-            db.add(event)
-            db.commit()
+        # the checkout worker posts to the bot, the page follows the job status
+        job = (await db.execute(checkout.enqueue([event.id]))).first()
+        if not job: # already queued or running for this ticket
+            job = (await db.execute(select(CheckoutJob.id).where(CheckoutJob.event_id == event.id))).first()
+        await db.execute(checkout.wake())
+        await db.commit()
 
-            return {}
+        return {"job_id": job.id}
     except Exception as e:
         logger.error(e)
-        db.rollback()
-
-        event.status = Event.STATUS_FAILED
-        db.add(event)
-        db.commit()
+        await db.rollback() # the claim is rolled back with the job, the ticket stays new
 
     return JSONResponse({"error":  "Internal server error"}, 500)
 
+
+@app.get("/checkout-jobs/{job_id}")
+async def checkout_job(job_id: int, db: AsyncSession = Depends(get_async_db)):
+    job = (await db.execute(select(CheckoutJob).where(CheckoutJob.id == job_id))).scalars().first()
+    if not job:
+        return JSONResponse({"error": "Checkout job not found"}, 404)
+
+    return checkout.job_dict(job)
+
 @app.delete("/event/{event_id}")
-def delete_event(event_id: int, db: Session = Depends(get_db)):
-    event = db.query(Event).filter(Event.id == event_id).first()
+async def delete_event(event_id: int, db: AsyncSession = Depends(get_async_db)):
+    # compare-and-set, only the request (from any worker or replica) that flips the flag moves the counters
+    event = (await db.execute(
+        update(Event)
+        .where(Event.id == event_id, Event.is_active == True)
+        .values(is_active=False, updated_at=datetime.utcnow())
+        .returning(Event.id, Event.event_id)
+    )).first()
     if not event:
-        return {}
+        await db.rollback()
+        exists = (await db.execute(select(Event.id).where(Event.id == event_id))).first()
+        return {"success": True} if exists else {}
     try:
-        event.is_active = False
-        db.add(event)
-        db.commit()
+        await summary.apply_async(db, summary.deactivated(event))
+        await db.execute(changes.notify([event.id], changes.DELETED))
+        await db.commit()
         return {"success": True}
     except Exception as e:
         logger.error(e)
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error":  "Internal server error"}, 500)
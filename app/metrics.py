@@ -0,0 +1,110 @@
+import time
+from contextvars import ContextVar
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+
+# Shared by the web app, the Discord listener and the checkout worker, each process exposes its own registry.
+# The listener and the worker serve it with prometheus_client.start_http_server, the app on /metrics.
+
+# per request DB accounting, set by the app middleware: [queries, seconds]
+request_db = ContextVar("request_db", default=None)
+
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ["engine"])
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement latency",
+    ["engine"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def instrument_engine(engine, name):
+    """
+    Count and time every statement of a sync engine (pass async_engine.sync_engine for asyncio).
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERIES.labels(name).inc()
+        DB_QUERY_SECONDS.labels(name).observe(elapsed)
+        current = request_db.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    if not pools.engines:
+        # one collector for all engines, the registry rejects a second one with the same metric names
+        REGISTRY.register(pools)
+    pools.engines[name] = engine
+
+
+class PoolCollector:
+    """
+    Connection pool usage of every instrumented engine, read when Prometheus scrapes.
+    """
+
+    def __init__(self):
+        self.engines = {}
+
+    def collect(self):
+        families = {
+            "size": GaugeMetricFamily("db_pool_size", "Pool size (persistent connections)", labels=["engine"]),
+            "checkedout": GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"]),
+            "checkedin": GaugeMetricFamily("db_pool_checked_in", "Idle connections in the pool", labels=["engine"]),
+            "overflow": GaugeMetricFamily("db_pool_overflow", "Connections opened above the pool size", labels=["engine"]),
+        }
+        for attr, family in families.items():
+            for name, engine in self.engines.items():
+                value = getattr(engine.pool, attr, None)
+                if value is not None:
+                    family.add_metric([name], value())
+            yield family
+
+
+pools = PoolCollector()
+
+
+class StatsCollector:
+    """
+    Exposes the counters the in-process caches and outbound clients already keep.
+    Takes callables so nothing is imported here that the scripts can't import.
+    """
+
+    def __init__(self, caches=None, outbound=None):
+        self.caches = caches
+        self.outbound = outbound
+
+    def collect(self):
+        if self.caches:
+            size = GaugeMetricFamily("cache_size", "Entries in the cache", labels=["cache"])
+            hits = CounterMetricFamily("cache_hits", "Cache hits", labels=["cache"])
+            misses = CounterMetricFamily("cache_misses", "Cache misses", labels=["cache"])
+            for stats in self.caches():
+                size.add_metric([stats["name"]], stats["size"])
+                hits.add_metric([stats["name"]], stats["hits"])
+                misses.add_metric([stats["name"]], stats["misses"])
+            yield size
+            yield hits
+            yield misses
+
+        if self.outbound:
+            requests = CounterMetricFamily("outbound_requests", "Outbound HTTP requests", labels=["upstream"])
+            errors = CounterMetricFamily("outbound_errors", "Outbound HTTP errors and status >= 400", labels=["upstream"])
+            seconds = CounterMetricFamily("outbound_latency_seconds", "Outbound HTTP time spent", labels=["upstream"])
+            for name, m in self.outbound().items():
+                requests.add_metric([name], m["requests"])
+                errors.add_metric([name], m["errors"])
+                seconds.add_metric([name], m["latency_total"])
+            yield requests
+            yield errors
+            yield seconds
+
+
+def register_stats(caches=None, outbound=None):
+    REGISTRY.register(StatsCollector(caches, outbound))
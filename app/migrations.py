@@ -0,0 +1,208 @@
+import os
+import logging
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+try:
+    from .db import Base, engine
+    from . import summary
+except ImportError: # run as a script from app/
+    from db import Base, engine
+    import summary
+
+
+logger = logging.getLogger(__name__)
+LOCK_KEY = 726001 # pg advisory lock, one migrator at a time across app replicas
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 10000))
+
+
+def baseline(conn):
+    # fresh databases get the current models (indexes included), the steps below are all no-ops there
+    Base.metadata.create_all(bind=conn)
+
+
+def build_index(name, definition, unique=False):
+    """
+    CREATE [UNIQUE] INDEX CONCURRENTLY step for a non-transactional migration. A build that failed halfway
+    leaves an INVALID index that IF NOT EXISTS would skip for good, so that one is dropped and rebuilt.
+    """
+    def step(conn):
+        valid = conn.execute(
+            text("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"),
+            {"name": name},
+        ).scalar()
+        if valid is False:
+            logger.info(f"Rebuilding invalid index {name}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+    return step
+
+
+def backfill_normalized(table):
+    """
+    Step that fills section_bucket, row_num and expire_ts of existing rows, BATCH_SIZE ids per
+    autocommitted UPDATE like the archiver, so no long transaction holds row locks against the listener.
+    """
+    def step(conn):
+        low, high = conn.execute(text(f"SELECT min(id), max(id) FROM {table}")).one()
+        if low is None:
+            return
+        last = low - 1
+        while last < high:
+            # SQL versions of normalize.section_bucket and normalize.row_number, expire_at is local time
+            # and the timestamptz cast reads it in the server TimeZone like datetime.timestamp() does in the app
+            conn.execute(text(f"""UPDATE {table} SET
+                section_bucket = CASE
+                    WHEN section ~ '^0*[1-5][0-9]{{2}}$' THEN substring(section FROM '([1-5])[0-9]{{2}}$') || '00x'
+                    WHEN section ~ '^[0-9]+$' THEN NULL
+                    ELSE NULLIF(section, '')
+                END,
+                row_num = CASE
+                    WHEN btrim(row) ~ '^[0-9]{{1,9}}$' THEN btrim(row)::integer
+                    WHEN btrim(row) ~ '^[A-Z]$' THEN ascii(btrim(row)) - 64
+                    WHEN btrim(row) ~ '^([A-Z])\\1$' THEN ascii(btrim(row)) - 38
+                END,
+                expire_ts = extract(epoch FROM expire_at::timestamptz)::bigint
+                WHERE id > :last AND id <= :last + :batch_size"""), {"last": last, "batch_size": BATCH_SIZE})
+            last += BATCH_SIZE
+            logger.info(f"Backfilled {table} up to id {min(last, high)} of {high}")
+    return step
+
+
+def backfill_summaries(conn):
+    with Session(bind=conn) as db:
+        summary.backfill(db)
+        db.flush()
+
+
+# (version, name, steps, transactional)
+# steps is a callable(conn) or a list of SQL statements and callables, and must be idempotent.
+# Non-transactional migrations run in autocommit so they can build indexes CONCURRENTLY.
+MIGRATIONS = [
+    (1, "baseline", baseline, True),
+    (2, "events message_id/posted_at, event_summaries pending_count", [
+        "ALTER TABLE events ADD COLUMN IF NOT EXISTS message_id VARCHAR",
+        "ALTER TABLE events ADD COLUMN IF NOT EXISTS posted_at TIMESTAMP WITHOUT TIME ZONE",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_events_message_id ON events (message_id)",
+        "CREATE INDEX IF NOT EXISTS ix_events_posted_at ON events (posted_at)",
+        "ALTER TABLE event_summaries ADD COLUMN IF NOT EXISTS pending_count INTEGER NOT NULL DEFAULT 0",
+    ], True),
+    (3, "backfill event_summaries", backfill_summaries, True),
+    (4, "unique lookups and small table indexes", [
+        # .first() lookups assume one row per key, keep the oldest duplicate
+        "DELETE FROM event_details a USING event_details b WHERE a.event_id = b.event_id AND a.id > b.id",
+        "DROP INDEX IF EXISTS ix_event_details_event_id",
+        "CREATE UNIQUE INDEX ix_event_details_event_id ON event_details (event_id)",
+        "DELETE FROM bot_accounts a USING bot_accounts b WHERE a.email = b.email AND a.id > b.id",
+        "DROP INDEX IF EXISTS ix_bot_accounts_email",
+        "CREATE UNIQUE INDEX ix_bot_accounts_email ON bot_accounts (email)",
+        "CREATE INDEX IF NOT EXISTS ix_auto_aproval_rules_event_id_section ON auto_aproval_rules (event_id, section, row)",
+        "CREATE INDEX IF NOT EXISTS ix_checkout_jobs_open ON checkout_jobs (id) WHERE status IN ('queued', 'running')",
+    ], True),
+    (5, "events partial indexes for active tickets", [
+        build_index("ix_events_active_id", "ON events (id) WHERE is_active = true"),
+        build_index("ix_events_active_event_id_id", "ON events (event_id, id) WHERE is_active = true"),
+    ], False),
+    (6, "events_archive", [
+        # same columns as events, archiver.py moves cold rows here, columns added to events later go here too
+        "CREATE TABLE IF NOT EXISTS events_archive ("
+        "LIKE events INCLUDING DEFAULTS, archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), PRIMARY KEY (id))",
+        "CREATE INDEX IF NOT EXISTS ix_events_archive_event_id ON events_archive (event_id)",
+    ], True),
+    (7, "listener_state", [
+        "CREATE TABLE IF NOT EXISTS listener_state ("
+        "name VARCHAR PRIMARY KEY, value VARCHAR, updated_at TIMESTAMP WITHOUT TIME ZONE)",
+    ], True),
+    (8, "listener_inbox", [
+        "CREATE TABLE IF NOT EXISTS listener_inbox ("
+        "id SERIAL PRIMARY KEY, message_id VARCHAR NOT NULL UNIQUE, posted_at BIGINT NOT NULL, "
+        "payload JSONB NOT NULL, created_at TIMESTAMP WITHOUT TIME ZONE)",
+    ], True),
+    (9, "events section_bucket/row_num/expire_ts", [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}"
+        for table in ("events", "events_archive")
+        for column in ("section_bucket VARCHAR", "row_num INTEGER", "expire_ts BIGINT")
+    ] + [
+        backfill_normalized("events"),
+        backfill_normalized("events_archive"),
+    ], False),
+    (10, "events filter and sort indexes", [
+        build_index("ix_events_active_roi_id", "ON events (roi DESC NULLS LAST, id) WHERE is_active = true"),
+        build_index("ix_events_active_expire_ts_id", "ON events (expire_ts, id) WHERE is_active = true"),
+        build_index("ix_events_active_section_bucket_row_num", "ON events (section_bucket, row_num) WHERE is_active = true"),
+    ], False),
+    (11, "events deals indexes", [
+        build_index(
+            "ix_events_deals",
+            "ON events (roi DESC, expire_ts, id) WHERE is_active = true AND status = 'new' AND roi IS NOT NULL",
+        ),
+        build_index(
+            "ix_events_deals_event_id",
+            "ON events (event_id, roi DESC, expire_ts, id) WHERE is_active = true AND status = 'new' AND roi IS NOT NULL",
+        ),
+    ], False),
+    (12, "events_version", [
+        "CREATE TABLE IF NOT EXISTS events_version (id INTEGER PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0)",
+        "INSERT INTO events_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+    ], True),
+    (13, "events_archive message_id/posted_at indexes", [
+        # messages archived and then ingested again before this, the later copies keep their row but not the message
+        "UPDATE events_archive a SET message_id = NULL FROM events_archive b "
+        "WHERE a.message_id = b.message_id AND a.id > b.id",
+        build_index("ix_events_archive_message_id", "ON events_archive (message_id)", unique=True),
+        build_index("ix_events_archive_posted_at", "ON events_archive (posted_at)"),
+    ], False),
+]
+
+
+def run(conn, steps):
+    if callable(steps):
+        steps(conn)
+        return
+    for step in steps:
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(text(step))
+
+
+def record(conn, version, name):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+        {"version": version, "name": name},
+    )
+
+
+def migrate():
+    with engine.connect() as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        # session-level lock survives the commit, an open transaction here would block CONCURRENTLY
+        lock.commit()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+                ))
+                applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+            for version, name, steps, transactional in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                logger.info(f"Applying migration {version}: {name}")
+                if transactional:
+                    with engine.begin() as conn:
+                        run(conn, steps)
+                        record(conn, version, name)
+                else:
+                    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        run(conn, steps)
+                        record(conn, version, name)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+            lock.commit()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    migrate()
@@ -0,0 +1,74 @@
+EVENT_ROWS_MAPPER = {
+    "A": 1, 
+    "B": 2, 
+    "C": 3, 
+    "D": 4, 
+    "E": 5, 
+    "F": 6, 
+    "G": 7, 
+    "H": 8, 
+    "I": 9, 
+    "J": 10,
+    "K": 11, 
+    "L": 12, 
+    "M": 13, 
+    "N": 14, 
+    "O": 15, 
+    "P": 16, 
+    "Q": 17, 
+    "R": 18, 
+    "S": 19,
+    "T": 20, 
+    "U": 21, 
+    "V": 22, 
+    "W": 23, 
+    "X": 24, 
+    "Y": 25, 
+    "Z": 26, 
+    "AA": 27, 
+    "BB": 28,
+    "CC": 29, 
+    "DD": 30, 
+    "EE": 31, 
+    "FF": 32, 
+    "GG": 33, 
+    "HH": 34,
+    "II": 35, 
+    "JJ": 36,
+    "KK": 37, 
+    "LL": 38, 
+    "MM": 39, 
+    "NN": 40, 
+    "OO": 41, 
+    "PP": 42, 
+    "QQ": 43, 
+    "RR": 44,
+    "SS": 45, 
+    "TT": 46, 
+    "UU": 47, 
+    "VV": 48, 
+    "WW": 49, 
+    "XX": 50, 
+    "YY": 51, 
+    "ZZ": 52
+}
+
+def range_to_x(num):
+    if 100 <= num <= 599:
+        return f"{(num // 100) * 100}x"
+    return None
+
+
+def row_number(row):
+    row = row.strip() if row else None
+    if not row:
+        return None
+    if not row.isdigit():
+        return EVENT_ROWS_MAPPER.get(row)
+    return int(row)
+
+
+def section_bucket(section):
+    if section and section.isdigit():
+        return range_to_x(int(section))
+    return section or None
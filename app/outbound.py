@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+import aiohttp
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+
+load_dotenv()
+# Defaults per upstream, each one can be overridden with <UPSTREAM>_<SETTING> in .env,
+# e.g. AUTOMATIQ_READ_TIMEOUT=5 or CHECKOUT_MAX_CONNECTIONS=20
+UPSTREAMS = {
+    "discord_relay": {"connect_timeout": 3, "read_timeout": 10, "max_connections": 2},
+    "automatiq": {"connect_timeout": 3, "read_timeout": 10, "max_connections": 10},
+    "checkout": {"connect_timeout": 3, "read_timeout": float(os.getenv("CHECKOUT_TIMEOUT", 10)), "max_connections": 10},
+}
+KEEPALIVE = float(os.getenv("OUTBOUND_KEEPALIVE", 30))
+
+sessions = {}
+clients = {}
+metrics = { name : {"requests": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0} for name in UPSTREAMS }
+lock = threading.Lock()
+
+
+def setting(name, key):
+    value = os.getenv(f"{name.upper()}_{key.upper()}")
+    return type(UPSTREAMS[name][key])(value) if value else UPSTREAMS[name][key]
+
+
+def record(name, latency, error):
+    with lock:
+        m = metrics[name]
+        m["requests"] += 1
+        m["errors"] += 1 if error else 0
+        m["latency_total"] += latency
+        m["latency_max"] = max(m["latency_max"], latency)
+
+
+def session(name):
+    """
+    Pooled keep-alive requests.Session for threaded (sync) callers.
+    """
+    with lock:
+        if name not in sessions:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=setting(name, "max_connections"), max_retries=0)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            sessions[name] = s
+        return sessions[name]
+
+
+def request(name, method, url, **kwargs):
+    kwargs.setdefault("timeout", (setting(name, "connect_timeout"), setting(name, "read_timeout")))
+    started = time.monotonic()
+    error = True
+    try:
+        resp = session(name).request(method, url, **kwargs)
+        error = resp.status_code >= 400
+        return resp
+    finally:
+        record(name, time.monotonic() - started, error)
+
+
+def _trace(name):
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.monotonic()
+
+    async def on_request_end(session, ctx, params):
+        record(name, time.monotonic() - ctx.started, params.response.status >= 400)
+
+    async def on_request_exception(session, ctx, params):
+        record(name, time.monotonic() - ctx.started, True)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    trace.on_request_exception.append(on_request_exception)
+    return trace
+
+
+def client(name):
+    """
+    Pooled keep-alive aiohttp session for asyncio callers, created on first use inside the running loop.
+    """
+    if name not in clients or clients[name].closed:
+        clients[name] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=setting(name, "max_connections"),
+                limit_per_host=setting(name, "max_connections"),
+                keepalive_timeout=KEEPALIVE,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=setting(name, "connect_timeout"),
+                sock_read=setting(name, "read_timeout"),
+            ),
+            trace_configs=[_trace(name)],
+        )
+    return clients[name]
+
+
+async def close():
+    for c in clients.values():
+        await c.close()
+    clients.clear()
+
+
+def stats():
+    with lock:
+        return {
+            name : {
+                **m,
+                "latency_avg": round(m["latency_total"] / m["requests"], 4) if m["requests"] else None,
+            }
+            for name, m in metrics.items()
+        }
@@ -0,0 +1,53 @@
+from bisect import bisect_right
+from itertools import accumulate
+try:
+    from .normalize import row_number
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    from normalize import row_number
+
+
+ROWS_AHEAD = 3 # a ticket competes with listings from row 1 up to its own row + 3
+
+
+def listing_prices(listings):
+    """
+    (row number, price in dollars) of the Automatiq listings that have both.
+    """
+    prices = []
+    for listing in listings:
+        listing = listing.get("attributes")
+        if not listing:
+            continue
+
+        price = listing.get("price")
+        section = listing.get("section")
+        row = row_number(listing.get("row"))
+        if not price or not section or not row:
+            continue
+
+        prices.append((row, price / 100))
+    return prices
+
+
+def lowest_prices(prices, rows):
+    """
+    Lowest listing price for each ticket row in rows (None where nothing competes): listings sorted
+    by row with a running minimum, then one binary search per ticket. Sized by the listings, not
+    by their row numbers, which come straight from Automatiq.
+    """
+    if not prices:
+        return [None] * len(rows)
+
+    prices = sorted(prices)
+    listing_rows = [row for row, _ in prices]
+    running = list(accumulate((price for _, price in prices), min))
+
+    lowest = []
+    for row in rows:
+        i = bisect_right(listing_rows, row + ROWS_AHEAD) if row else 0
+        lowest.append(running[i - 1] if i else None)
+    return lowest
+
+
+def roi(lowest_price, price_plus_fees):
+    return round(((lowest_price / price_plus_fees * 0.9) - 1) * 100, 2) if price_plus_fees else 0
@@ -0,0 +1,140 @@
+import time
+from sqlalchemy import DateTime, String, asc, column, desc, func, select, table, true
+try:
+    from .db import Event, EventSummary
+except ImportError: # imported from the listener and check_indexes.py, which run with app/ on sys.path
+    from db import Event, EventSummary
+
+
+# Hot statements of the pages and the listener, built here so check_indexes.py explains
+# exactly what main.py and discord_listener.py run.
+PER_PAGE = 25
+
+# only what the tickets page shows, selected as plain rows instead of Event instances
+ITEM_COLUMNS = [
+    Event.id,
+    Event.event_id,
+    Event.bot_email,
+    Event.section,
+    Event.row,
+    Event.amount,
+    Event.price,
+    Event.full_price,
+    Event.price_plus_fees,
+    Event.listing_low_price,
+    Event.roi,
+    Event.expire_at,
+    Event.encsoft_url,
+    Event.cvv,
+    Event.status,
+    Event.is_active,
+]
+ITEM_KEYS = [c.key for c in ITEM_COLUMNS]
+
+NO_FILTERS = {"section": None, "max_row": None, "min_roi": None, "unexpired": False, "sort": "id"}
+# archiver.py moves cold rows here, the listener's dedup and resume point look at both tables
+ARCHIVE = table("events_archive", column("message_id", String), column("posted_at", DateTime))
+
+SORTS = {
+    "roi": [Event.roi.desc().nullslast(), Event.id],
+    "expire": [Event.expire_ts, Event.id],
+}
+
+
+def tickets(page, event_id, filters=NO_FILTERS, after_id=None, before_id=None):
+    """
+    (page query, total scalar subquery) of /items/ and /tickets, the total also rides along with every row.
+    """
+    where = [Event.is_active == True]
+    if event_id and event_id != "Any":
+        where.append(Event.event_id == event_id)
+    # all on the columns normalized at ingest, so the database does the filtering
+    narrowed = []
+    if filters["section"]:
+        narrowed.append(Event.section_bucket == filters["section"])
+    if filters["max_row"]:
+        narrowed.append(Event.row_num <= filters["max_row"])
+    if filters["min_roi"] is not None:
+        narrowed.append(Event.roi >= filters["min_roi"])
+    if filters["unexpired"]:
+        narrowed.append(Event.expire_ts > int(time.time()))
+    where += narrowed
+
+    if narrowed: # the counters don't know about the filters, count the matching rows
+        total = select(func.count()).select_from(Event).where(*where).correlate(None)
+    else:
+        # total comes from the maintained per-event counters
+        total = select(func.coalesce(func.sum(EventSummary.active_count), 0))
+        if event_id and event_id != "Any":
+            total = total.where(EventSummary.event_id == event_id)
+    total = total.scalar_subquery()
+    query = select(*ITEM_COLUMNS, total.label("total")).where(*where)
+
+    sort = SORTS.get(filters["sort"])
+    if sort:
+        # ROI and expiry pages go by page number only, the cursors follow the id order
+        query = query.order_by(*sort).offset((page - 1) * PER_PAGE)
+    # cursors seek straight to the page through the primary key, page numbers still work with OFFSET
+    elif after_id:
+        query = query.where(Event.id > after_id).order_by(asc(Event.id))
+    elif before_id:
+        query = query.where(Event.id < before_id).order_by(desc(Event.id))
+    else:
+        query = query.order_by(asc(Event.id)).offset((page - 1) * PER_PAGE)
+
+    return query.limit(PER_PAGE), total
+
+
+def deals(limit, event_id=None, per_event=None):
+    """
+    Top tickets that can still be bought, best ROI first and the sooner expiring first on a tie.
+    Walks ix_events_deals (or ix_events_deals_event_id) from the top, so the table size doesn't matter.
+    """
+    deal = [
+        Event.is_active == True,
+        Event.status == Event.STATUS_NEW,
+        Event.roi.isnot(None),
+        Event.expire_ts > int(time.time()),
+    ]
+    order = [Event.roi.desc(), Event.expire_ts, Event.id]
+
+    if per_event:
+        # the best few of every event that has new tickets, one index probe per event
+        top = select(*ITEM_COLUMNS, Event.expire_ts) \
+            .where(Event.event_id == EventSummary.event_id, *deal) \
+            .order_by(*order) \
+            .limit(per_event) \
+            .lateral()
+        query = select(*[top.c[k] for k in ITEM_KEYS]) \
+            .select_from(EventSummary) \
+            .join(top, true()) \
+            .where(EventSummary.new_count > 0) \
+            .order_by(top.c.roi.desc(), top.c.expire_ts, top.c.id)
+        if event_id and event_id != "Any":
+            query = query.where(EventSummary.event_id == event_id)
+    else:
+        query = select(*ITEM_COLUMNS).where(*deal).order_by(*order)
+        if event_id and event_id != "Any":
+            query = query.where(Event.event_id == event_id)
+
+    return query.limit(limit)
+
+
+def events(page):
+    return select(EventSummary) \
+        .order_by(asc(EventSummary.event_id)) \
+        .offset((page - 1) * PER_PAGE) \
+        .limit(PER_PAGE)
+
+
+def stored_message_ids(message_ids):
+    return select(Event.message_id).where(Event.message_id.in_(message_ids)) \
+        .union_all(select(ARCHIVE.c.message_id).where(ARCHIVE.c.message_id.in_(message_ids)))
+
+
+def last_posted_at():
+    # greatest() skips NULLs, so an empty archive doesn't hide the hot table's max
+    return select(func.greatest(
+        select(func.max(Event.posted_at)).scalar_subquery(),
+        select(func.max(ARCHIVE.c.posted_at)).scalar_subquery(),
+    ))
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import select, update
+from db import AsyncSessionLocal, Event
+import automatiq
+import changes
+import lookups
+import outbound
+import pricing
+from dotenv import load_dotenv
+
+
+load_dotenv()
+os.makedirs(os.getenv("LOG_DIR"), exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[
+        logging.FileHandler(os.path.join(os.getenv("LOG_DIR"), "repricer.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+INTERVAL = float(os.getenv("REPRICE_INTERVAL", 60))
+CONCURRENCY = int(os.getenv("REPRICE_CONCURRENCY", 4))
+MAX_PAGES = int(os.getenv("REPRICE_MAX_PAGES", 10))
+
+
+async def load_groups():
+    """
+    Active, unexpired tickets grouped by (automatiq_event_id, section), one listings fetch per group.
+    """
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(
+            select(Event.id, Event.event_id, Event.section, Event.row_num, Event.price_plus_fees, Event.listing_low_price, Event.roi)
+            .where(Event.is_active == True, Event.expire_ts > int(time.time()))
+        )).all()
+        event_details = await lookups.event_details_async(db, {row.event_id for row in rows})
+
+    groups = {}
+    for row in rows:
+        details = event_details.get(row.event_id)
+        if not details or not details[1] or not row.section:
+            continue
+        groups.setdefault((details[1], row.section), []).append(row)
+    return groups
+
+
+async def reprice(key, rows, semaphore):
+    async with semaphore:
+        listings = await automatiq.all_listings(*key, MAX_PAGES)
+    if listings is None: # keep the old prices when Automatiq failed
+        return 0
+
+    lowest = pricing.lowest_prices(pricing.listing_prices(listings), [row.row_num for row in rows])
+    now = datetime.utcnow()
+    changed = []
+    for row, price in zip(rows, lowest):
+        roi = pricing.roi(price, row.price_plus_fees) if price else None
+        if price != row.listing_low_price or roi != row.roi:
+            changed.append({"id": row.id, "listing_low_price": price, "roi": roi, "updated_at": now})
+    if not changed:
+        return 0
+
+    # bulk UPDATE by primary key, one executemany for the whole group
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Event), changed)
+        await db.execute(changes.notify([c["id"] for c in changed], changes.UPDATED))
+        await db.commit()
+    return len(changed)
+
+
+async def run():
+    started = time.monotonic()
+    groups = await load_groups()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    results = await asyncio.gather(
+        *(reprice(key, rows, semaphore) for key, rows in groups.items()),
+        return_exceptions=True,
+    )
+
+    updated = 0
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(result)
+        else:
+            updated += result
+    logger.info(
+        f"Repriced {sum(len(rows) for rows in groups.values())} tickets in {len(groups)} groups, "
+        f"{updated} changed, {time.monotonic() - started:.1f}s"
+    )
+
+
+async def main():
+    try:
+        while True:
+            try:
+                await run()
+            except Exception as e:
+                logger.error(e)
+            await asyncio.sleep(INTERVAL)
+    finally:
+        await outbound.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Shutting down ...")
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+try:
+    from .db import AsyncSessionLocal, AutoAprovalRules
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    from db import AsyncSessionLocal, AutoAprovalRules
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", 10))
+
+# (event_id, section bucket) -> the highest row a rule still approves
+index = {}
+
+
+def query():
+    return select(AutoAprovalRules.event_id, AutoAprovalRules.section, func.max(AutoAprovalRules.row)) \
+        .where(AutoAprovalRules.row.isnot(None)) \
+        .group_by(AutoAprovalRules.event_id, AutoAprovalRules.section)
+
+
+async def reload(db):
+    global index
+    rows = (await db.execute(query())).all()
+    index = { (event_id, section) : max_row for event_id, section, max_row in rows }
+
+
+async def keep_fresh():
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL)
+        try:
+            async with AsyncSessionLocal() as db:
+                await reload(db)
+        except Exception as e:
+            logger.error(e)
+
+
+def is_approved(event_id, section_bucket, row_num):
+    # the ticket's normalized Event.section_bucket and Event.row_num
+    if not section_bucket or not row_num:
+        return False
+
+    max_row = index.get((event_id, section_bucket))
+    return max_row is not None and max_row >= row_num
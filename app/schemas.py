@@ -1,5 +1,44 @@
+from typing import Optional
 from pydantic import BaseModel, constr, HttpUrl
 
 
 class EventCreate(BaseModel):
     fields: list
+
+
+class TicketItem(BaseModel):
+    id: int
+    event_id: Optional[str]
+    event_name: Optional[str]
+    bot_email: Optional[str]
+    section: Optional[str]
+    row: Optional[str]
+    amount: Optional[int]
+    price: Optional[float]
+    full_price: Optional[float]
+    price_plus_fees: Optional[float]
+    listing_low_price: Optional[float]
+    roi: Optional[float]
+    expire_at: Optional[int] # epoch seconds
+    encsoft_url: Optional[str]
+    cvv: Optional[str]
+    status: Optional[str]
+    is_active: bool
+
+
+class Cursors(BaseModel):
+    before_id: Optional[int]
+    after_id: Optional[int]
+
+
+class ItemsPage(BaseModel):
+    items: list[TicketItem]
+    page: int
+    per_page: int
+    total: int
+    cursors: Cursors
+
+
+class DealsPage(BaseModel):
+    items: list[TicketItem]
+    limit: int
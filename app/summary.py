@@ -0,0 +1,116 @@
+from datetime import datetime as dt
+from sqlalchemy import case, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+try:
+    from .db import Event, EventSummary
+except ImportError: # imported from the listener, which runs with app/ on sys.path
+    from db import Event, EventSummary
+
+
+# Per-event aggregates for the /events dashboard, kept up to date by every write path
+# in the same transaction as the events change itself.
+STATUS_COLUMNS = {
+    Event.STATUS_NEW: "new_count",
+    Event.STATUS_PENDING: "pending_count",
+    Event.STATUS_SCHEDULED: "scheduled_count",
+    Event.STATUS_FAILED: "failed_count",
+}
+COLUMNS = ["full_price_total", *STATUS_COLUMNS.values(), "active_count", "total_count"]
+
+
+def _add(deltas, event_id, column, value):
+    if event_id is None or not column or not value:
+        return
+    row = deltas.setdefault(event_id, {})
+    row[column] = row.get(column, 0) + value
+
+
+def _status(deltas, event, status, sign):
+    _add(deltas, event.event_id, STATUS_COLUMNS.get(status), sign)
+    if status == Event.STATUS_SCHEDULED:
+        _add(deltas, event.event_id, "full_price_total", sign * (event.full_price or 0))
+
+
+def created(event, deltas=None):
+    deltas = {} if deltas is None else deltas
+    _add(deltas, event.event_id, "total_count", 1)
+    if event.is_active is not False:
+        _add(deltas, event.event_id, "active_count", 1)
+    _status(deltas, event, event.status, 1)
+    return deltas
+
+
+def status_changed(event, old_status, deltas=None):
+    deltas = {} if deltas is None else deltas
+    if old_status != event.status:
+        _status(deltas, event, old_status, -1)
+        _status(deltas, event, event.status, 1)
+    return deltas
+
+
+def deactivated(event, deltas=None):
+    deltas = {} if deltas is None else deltas
+    _add(deltas, event.event_id, "active_count", -1)
+    return deltas
+
+
+def statement(deltas):
+    """
+    Single upsert that applies all accumulated deltas, or None if there is nothing to apply.
+    """
+    if not deltas:
+        return None
+
+    rows = [
+        {"event_id": event_id, **{c: row.get(c, 0) for c in COLUMNS}, "updated_at": dt.utcnow()}
+        # in event_id order, so concurrent writers lock the summary rows in the same order and can't deadlock
+        for event_id, row in sorted(deltas.items(), key=lambda item: item[0] or "")
+    ]
+    stmt = insert(EventSummary).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[EventSummary.event_id],
+        set_={
+            **{c: getattr(EventSummary, c) + getattr(stmt.excluded, c) for c in COLUMNS},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+def apply(db, deltas):
+    stmt = statement(deltas)
+    if stmt is not None:
+        db.execute(stmt)
+
+
+async def apply_async(db, deltas):
+    stmt = statement(deltas)
+    if stmt is not None:
+        await db.execute(stmt)
+
+
+def backfill(db):
+    """
+    Build event_summaries from the events table if it's empty (first deploy).
+    Writers block on the table lock until this commits, so no delta gets lost or counted twice.
+    """
+    db.execute(text("LOCK TABLE event_summaries IN EXCLUSIVE MODE"))
+    if db.query(EventSummary.event_id).first():
+        return False
+
+    def count(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    query = select(
+        Event.event_id,
+        func.coalesce(
+            func.sum(case((Event.status == Event.STATUS_SCHEDULED, Event.full_price), else_=0)),
+            0
+        ),
+        *[count(Event.status == status) for status in STATUS_COLUMNS],
+        count(Event.is_active == True),
+        func.count(Event.id),
+        func.now(),
+    ).where(Event.event_id.isnot(None)).group_by(Event.event_id)
+
+    db.execute(insert(EventSummary).from_select(["event_id", *COLUMNS, "updated_at"], query))
+    return True
@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def use_app_dir():
+    # the listener and worker modules import each other as top-level modules, the same way `cd app` does
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Latencies in seconds -> the numbers stored in the baselines (ms and requests per second).
+    """
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+    }
+
+
+def report(results):
+    print(f"{'name':<32} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per sec':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<32} {r['requests']:>9} {r['errors']:>7} {r['p50_ms'] or '-':>9} {r['p95_ms'] or '-':>9} "
+            f"{r['p99_ms'] or '-':>9} {r['throughput'] or '-':>9}"
+        )
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+def save_baselines(results):
+    baselines = load_baselines()
+    baselines.update(results)
+    with open(BASELINES, "w") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results, tolerance):
+    """
+    Regressions against the stored baselines: p95 slower or throughput lower by more than tolerance,
+    or no baseline at all.
+    """
+    baselines = load_baselines()
+    regressions = []
+    for name, r in results.items():
+        base = baselines.get(name)
+        if not base:
+            # a run without a baseline proves nothing, record one first
+            regressions.append(f"{name}: no baseline in {BASELINES}, record it with --save-baseline")
+            continue
+        if base.get("p95_ms") and r["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {r['p95_ms']}ms, baseline {base['p95_ms']}ms")
+        if base.get("throughput") and r["throughput"] and r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: {r['throughput']}/s, baseline {base['throughput']}/s")
+        if r["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: {r['errors']} errors, baseline {base.get('errors', 0)}")
+    return regressions
+
+
+def finish(results, args):
+    report(results)
+    if args.save_baseline:
+        save_baselines(results)
+        print(f"Baselines saved to {BASELINES}")
+        return 0
+
+    regressions = compare(results, args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r}")
+    return 1 if regressions else 0
+
+
+def add_baseline_args(parser):
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing, 0.2 = 20%%")
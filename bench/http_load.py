@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import random
+import sys
+import time
+import aiohttp
+from bench.common import add_baseline_args, finish, summarize, use_app_dir
+
+use_app_dir()
+from sqlalchemy import select
+from db import SessionLocal, Event, EventSummary
+
+
+def sample(limit):
+    """
+    Real ids from the seeded database, so requests hit rows that exist.
+    """
+    with SessionLocal() as db:
+        event_ids = db.execute(select(EventSummary.event_id).where(EventSummary.active_count > 0)).scalars().all()
+        tickets = db.execute(
+            select(Event.id)
+            .where(Event.is_active == True, Event.status == Event.STATUS_NEW)
+            .order_by(Event.id.desc())
+            .limit(limit)
+        ).scalars().all()
+        pages = max(1, len(event_ids) // 25)
+    random.shuffle(tickets)
+    return event_ids, tickets, pages
+
+
+def tickets_params(event_ids):
+    params = {"event_id": "Any" if random.random() < 0.3 else random.choice(event_ids)}
+    if random.random() < 0.5:
+        params["page"] = random.randint(1, 10)
+    else:
+        params["after_id"] = random.randint(0, 100000)
+    if random.random() < 0.2: # the filters operators use most
+        params.update(random.choice([
+            {"sort": "roi", "min_roi": 0},
+            {"sort": "expire", "unexpired": "true"},
+            {"section": "100x", "max_row": 10},
+        ]))
+    return params
+
+
+def scenarios(event_ids, tickets, pages):
+    return {
+        "GET /items/": lambda: ("GET", "/items/", tickets_params(event_ids)),
+        "GET /tickets": lambda: ("GET", "/tickets", tickets_params(event_ids)),
+        "GET /events/": lambda: ("GET", "/events/", {"page": random.randint(1, pages)}),
+        "GET /deals/": lambda: ("GET", "/deals/", random.choice([
+            {},
+            {"event_id": random.choice(event_ids)},
+            {"per_event": 3},
+        ])),
+        # each ticket is claimed once, like the operators racing for it
+        "POST /buy-ticket": lambda: ("POST", f"/buy-ticket/{tickets.pop()}" if tickets else "/buy-ticket/0", None),
+    }
+
+
+async def load(session, base, make_request, concurrency, requests, duration):
+    latencies = []
+    errors = 0
+    remaining = requests
+    deadline = time.monotonic() + duration if duration else None
+
+    async def worker():
+        nonlocal errors, remaining
+        while True:
+            if deadline and time.monotonic() >= deadline:
+                return
+            if not deadline:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            method, path, params = make_request()
+            started = time.perf_counter()
+            try:
+                async with session.request(method, base + path, params=params) as resp:
+                    await resp.read()
+                    if resp.status >= 400:
+                        errors += 1
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.monotonic() - started
+
+
+async def main(args):
+    event_ids, tickets, pages = sample(args.requests * 2 if not args.duration else 100000)
+    if not event_ids:
+        sys.exit("No active events, run `python -m bench.seed` first")
+
+    available = scenarios(event_ids, tickets, pages)
+    selected = args.scenario or list(available)
+    results = {}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for name in selected:
+            # a short warmup so connection setup and cold caches don't land in the numbers
+            await load(session, args.url, available[name], args.concurrency, args.concurrency * 2, None)
+            latencies, errors, elapsed = await load(
+                session, args.url, available[name], args.concurrency, args.requests, args.duration
+            )
+            results[f"http {name} c={args.concurrency}"] = summarize(latencies, elapsed, errors)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the web endpoints of a running app")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=1000, help="per scenario, ignored with --duration")
+    parser.add_argument("--duration", type=float, default=None, help="seconds per scenario")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=["GET /items/", "GET /tickets", "GET /events/", "GET /deals/", "POST /buy-ticket"],
+    )
+    add_baseline_args(parser)
+    args = parser.parse_args()
+    sys.exit(finish(asyncio.run(main(args)), args))
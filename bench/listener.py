@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from bench.common import add_baseline_args, finish, summarize, use_app_dir
+from bench.stubs import Stubs, urls
+
+use_app_dir()
+
+
+async def main(args):
+    stubs = Stubs(per_poll=args.per_poll, window=args.window, latency=args.latency)
+    base = await stubs.start()
+    # before the listener modules are imported, automatiq reads its URL at import time
+    os.environ.update(urls(base))
+
+    from sqlalchemy import select
+    from db import AsyncSessionLocal, SessionLocal, AutoAprovalRules, BotAccount, EventDetails
+    import discord_listener
+    import outbound
+    import rules
+
+    async with AsyncSessionLocal() as db:
+        # approved sections of the rules plus arbitrary ones, so both approval paths run
+        approved = (await db.execute(select(AutoAprovalRules.event_id, AutoAprovalRules.section).limit(200))).all()
+        known = (await db.execute(select(EventDetails.event_id).limit(500))).scalars().all()
+        stubs.accounts = (await db.execute(select(BotAccount.email).limit(50))).scalars().all() or stubs.accounts
+        await rules.reload(db)
+    if not known:
+        sys.exit("No event_details, run `python -m bench.seed` first")
+    # rules hold section buckets ("100x"), the drops carry a real section inside the bucket
+    stubs.events = [(event_id, str(int(section[0]) * 100 + 1 + i % 30) if section[:1].isdigit() else section)
+                    for i, (event_id, section) in enumerate(approved)] \
+        + [(event_id, str(101 + i % 30)) for i, event_id in enumerate(known)]
+    discord_listener.start_time = datetime.now() - timedelta(seconds=5)
+
+    results = {}
+    cycles = []
+    started = time.monotonic()
+    try:
+        for _ in range(args.cycles):
+            cycle_started = time.perf_counter()
+            await discord_listener.run()
+            cycles.append(time.perf_counter() - cycle_started)
+        elapsed = time.monotonic() - started
+        # enrichment runs after the tickets are stored, off the cycle
+        await asyncio.gather(*discord_listener.enrichments)
+
+        r = summarize(cycles, elapsed)
+        # per message, the number that matters for how fast drops become tickets
+        r["throughput"] = round(args.cycles * args.per_poll / elapsed, 2)
+        results[f"listener cycle per_poll={args.per_poll}"] = r
+
+        if args.checkout:
+            results.update(await drain_checkout(args, SessionLocal))
+    finally:
+        await outbound.close()
+        await stubs.stop()
+    return results
+
+
+async def drain_checkout(args, SessionLocal):
+    """
+    Dispatch the jobs the cycles enqueued through the checkout worker's claim/dispatch, against the stub bot.
+    """
+    import checkout_worker
+
+    def drain():
+        latencies = []
+        while True:
+            with SessionLocal() as db:
+                job = checkout_worker.claim(db)
+                if not job:
+                    return latencies
+                started = time.perf_counter()
+                checkout_worker.dispatch(db, job)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    parts = await asyncio.gather(*(asyncio.to_thread(drain) for _ in range(args.workers)))
+    latencies = [l for part in parts for l in part]
+    return {f"checkout dispatch workers={args.workers}": summarize(latencies, time.monotonic() - started)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive discord_listener.run() against local stubs")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--per-poll", type=int, default=20, help="new relay messages per cycle")
+    parser.add_argument("--window", type=int, default=100, help="messages the relay returns per poll")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated upstream latency, seconds")
+    parser.add_argument("--checkout", action="store_true", help="also dispatch the enqueued checkout jobs")
+    parser.add_argument("--workers", type=int, default=4)
+    add_baseline_args(parser)
+    args = parser.parse_args()
+    sys.exit(finish(asyncio.run(main(args)), args))
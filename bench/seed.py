@@ -0,0 +1,170 @@
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from bench.common import use_app_dir
+
+use_app_dir()
+from sqlalchemy import text
+from db import engine, SessionLocal
+from migrations import migrate
+from normalize import row_number, section_bucket
+import summary
+
+
+TABLES = [
+    "events",
+    "events_archive",
+    "event_summaries",
+    "checkout_jobs",
+    "event_details",
+    "bot_accounts",
+    "auto_aproval_rules",
+    "listener_state",
+    "listener_inbox",
+]
+EVENT_COLUMNS = [
+    "message_id", "posted_at", "event_id", "event_name", "bot_email", "section", "row", "price", "amount",
+    "full_price", "price_plus_fees", "listing_low_price", "roi", "expire_at", "encsoft_url", "cvv", "status",
+    "is_active", "created_at", "updated_at", "section_bucket", "row_num", "expire_ts",
+]
+STATUSES = [("new", 70), ("scheduled", 15), ("failed", 10), ("pending", 5)]
+LETTER_ROWS = ["A", "B", "C", "D", "E", "F", "G", "H", "AA", "BB", "CC", "GA"]
+
+
+def event_ids(count):
+    return [f"{i:04X}{random.randrange(16 ** 12):012X}" for i in range(count)]
+
+
+def section():
+    if random.random() < 0.85:
+        return str(random.choice([random.randint(101, 130), random.randint(201, 235), random.randint(301, 330)]))
+    return random.choice(["FLOOR A", "FLOOR B", "GA", "PIT"])
+
+
+def row():
+    return str(random.randint(1, 40)) if random.random() < 0.8 else random.choice(LETTER_ROWS)
+
+
+def copy(conn, table, columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in rows:
+        writer.writerow(["" if v is None else v for v in r])
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')", buf)
+
+
+def event_rows(count, ids, names, emails, start):
+    now = datetime.now()
+    statuses, weights = zip(*STATUSES)
+    for i in range(count):
+        event_id = random.choice(ids)
+        amount = random.randint(1, 8)
+        price = round(random.uniform(40, 900), 2)
+        full_price = round(price * amount * 1.18, 2)
+        price_plus_fees = round(full_price / amount, 2)
+        low = round(price_plus_fees * random.uniform(0.8, 2.5), 2) if random.random() < 0.7 else None
+        roi = round(((low / price_plus_fees * 0.9) - 1) * 100, 2) if low else None
+        posted_at = now - timedelta(seconds=random.randint(0, 30 * 24 * 3600))
+        expire_at = now + timedelta(seconds=random.randint(-3600, 48 * 3600))
+        email = random.choice(emails)
+        ticket_section = section()
+        ticket_row = row()
+        yield (
+            f"bench-{start + i}",
+            posted_at,
+            event_id,
+            names[event_id],
+            email,
+            ticket_section,
+            ticket_row,
+            price,
+            amount,
+            full_price,
+            price_plus_fees,
+            low,
+            roi,
+            expire_at,
+            f"https://encsoft.app/checkout/{start + i}",
+            f"{random.randint(0, 999):03}",
+            random.choices(statuses, weights)[0],
+            random.random() < 0.8,
+            posted_at,
+            posted_at,
+            section_bucket(ticket_section),
+            row_number(ticket_row),
+            int(expire_at.timestamp()),
+        )
+
+
+def seed(args):
+    random.seed(args.seed)
+    migrate()
+
+    ids = event_ids(args.event_ids)
+    names = {event_id: f"Bench Event {i}" for i, event_id in enumerate(ids)}
+    emails = [f"bot{i}@bench.local" for i in range(args.accounts)]
+
+    conn = engine.raw_connection()
+    try:
+        if args.reset:
+            with conn.cursor() as cur:
+                cur.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY")
+
+        copy(conn, "event_details", ["event_id", "event_name", "automatiq_event_id"], (
+            (event_id, names[event_id], str(100000 + i)) for i, event_id in enumerate(ids)
+        ))
+        copy(conn, "bot_accounts", ["email", "cvv"], ((email, f"{random.randint(0, 999):03}") for email in emails))
+        # a few approval rules on a slice of the events, as the ops team keeps them: by section bucket, like rules.py reads them
+        copy(conn, "auto_aproval_rules", ["event_id", "event_name", "section", "row"], (
+            (event_id, names[event_id], random.choice(["100x", "200x", "300x"]), random.randint(1, 20))
+            for event_id in ids[: max(1, len(ids) // 10)]
+            for _ in range(5)
+        ))
+        conn.commit()
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM events")
+            start = cur.fetchone()[0]
+        started = time.monotonic()
+        done = 0
+        while done < args.events:
+            chunk = min(args.chunk, args.events - done)
+            copy(conn, "events", EVENT_COLUMNS, event_rows(chunk, ids, names, emails, start + done))
+            conn.commit()
+            done += chunk
+            print(f"events: {done}/{args.events} ({time.monotonic() - started:.1f}s)")
+
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+    # rebuilt from scratch so the counters match the seeded rows
+    with SessionLocal() as db:
+        db.execute(text("DELETE FROM event_summaries"))
+        summary.backfill(db)
+        db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a local database with realistic volumes for the benchmarks")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--event-ids", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help=f"truncate {', '.join(TABLES)} first")
+    parser.add_argument("--force", action="store_true", help="allow a DB_NAME without 'bench' in it")
+    args = parser.parse_args()
+
+    if "bench" not in (os.getenv("DB_NAME") or "") and not args.force:
+        sys.exit(f"Refusing to seed DB_NAME={os.getenv('DB_NAME')}, point DB_NAME at a bench database or pass --force")
+    seed(args)
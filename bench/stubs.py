@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+from aiohttp import web
+
+
+class Stubs:
+    """
+    Local stand-ins for the Discord relay, Automatiq listings and the checkout bot.
+    Latencies are simulated with asyncio.sleep so they cost no CPU.
+    """
+
+    def __init__(self, events=None, accounts=None, per_poll=10, window=100, latency=0.05, listings=40):
+        # events: [(event_id, section)] the relay posts about, accounts: bot emails
+        self.events = events or [("BENCH", "101")]
+        self.accounts = accounts or ["bot0@bench.local"]
+        self.per_poll = per_poll
+        self.messages = deque(maxlen=window)
+        self.latency = latency
+        self.listings = listings
+        self.ids = itertools.count(int(time.time() * 1000))
+        self.checkouts = 0
+
+    def message(self):
+        event_id, section = random.choice(self.events)
+        amount = random.randint(1, 6)
+        price = round(random.uniform(40, 900), 2)
+        fields = {
+            "Event ID": event_id,
+            "Account": random.choice(self.accounts),
+            "Section": section,
+            "Row": str(random.randint(1, 30)),
+            "Price": str(price),
+            "Full price": str(round(price * amount * 1.18, 2)),
+            "Amount": str(amount),
+            "Expiration": f"<t:{int(time.time()) + random.randint(600, 7200)}:R>",
+            "Full checkout": f"https://encsoft.app/checkout/{random.randrange(10 ** 9)}",
+        }
+        return {
+            "messageId": str(next(self.ids)),
+            "timestamp": int(time.time()),
+            "embeds": [{"fields": [{"name": k, "value": v} for k, v in fields.items()]}],
+        }
+
+    async def relay(self, request):
+        # like the real relay: the latest window of messages, narrowed by ?since= when the listener sends it
+        for _ in range(self.per_poll):
+            self.messages.append(self.message())
+        await asyncio.sleep(self.latency)
+
+        since = int(request.query.get("since", 0))
+        messages = [m for m in self.messages if m["timestamp"] >= since]
+        etag = f'"{messages[-1]["messageId"] if messages else since}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(messages, headers={"ETag": etag})
+
+    async def automatiq(self, request):
+        section = request.query.get("filter[section]", "101")
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "data": [
+                {"attributes": {
+                    "price": random.randint(4000, 120000),
+                    "section": section,
+                    "row": str(random.randint(1, 30)),
+                }}
+                for _ in range(self.listings)
+            ]
+        })
+
+    async def checkout(self, request):
+        await request.json()
+        await asyncio.sleep(self.latency)
+        self.checkouts += 1
+        return web.json_response({"success": True})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/messages", self.relay)
+        app.router.add_get("/listings/{automatiq_event_id}", self.automatiq)
+        app.router.add_post("/event_checkout", self.checkout)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def urls(base):
+    """
+    Env overrides that point the listener and the checkout worker at the stubs.
+    """
+    return {
+        "DISCORD_SERVER_SIDE_URL": f"{base}/messages",
+        "AUTOMATIQ_LISTINGS_URL": f"{base}/listings/{{}}",
+        "CHECKOUT_BOT_API_URL": f"{base}/event_checkout",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the relay, Automatiq and checkout bot stubs")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--per-poll", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for k, v in urls(f"http://127.0.0.1:{args.port}").items():
+        print(f"{k}={v}")
+    web.run_app(Stubs(per_poll=args.per_poll, latency=args.latency).app(), host="127.0.0.1", port=args.port)